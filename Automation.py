@@ -9,15 +9,42 @@ from googleapiclient.discovery import build
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 import re
-from datetime import datetime
 import argparse
 import torch
+import numpy as np
 import openai
 from dotenv import load_dotenv
 import json
 import time
+import threading
+import atexit
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
-from constants import CATEGORY_DISPLAY_NAMES, AUTO_RESPONSE_CATEGORIES, AUTO_RESPONSE_WAITING_TIMES
+import asyncio
+from mailbox_sync import MailboxSync
+from async_gmail import sort_emails_async
+from message_store import MessageStore, USER_VERSION
+from gmail_quota import shared_rate_limiter
+from label_queue import LabelChangeQueue
+from classifier import get_keyword_matcher
+from text_model import NaiveBayesClassifier, email_text
+from embedding_model import EmbeddingClassifier
+from classification_cache import ClassificationCache
+from sender_index import SenderIndex
+from response_cache import ResponseCache
+from mime_parts import find_text_parts, decode_part
+from html_text import html_to_text
+from message_headers import header_index, message_date
+from email_info import EmailInfo, sender_name, sender_address
+from constants import (
+    CATEGORY_DISPLAY_NAMES, AUTO_RESPONSE_CATEGORIES, AUTO_RESPONSE_WAITING_TIMES,
+    GMAIL_BATCH_SIZE, GMAIL_PAGE_SIZE, METADATA_HEADERS, GMAIL_FIELD_MASKS, FETCH_WORKERS,
+    CATEGORY_KEYWORDS, ONLINE_LEARNING_MIN_EXAMPLES, ONLINE_LEARNING_MIN_CLASSES, ONLINE_LEARNING_MIN_CLASS_EXAMPLES,
+    ONLINE_LEARNING_MIN_CONFIDENCE, MODEL_SAVE_INTERVAL,
+    BODY_SCAN_CHARS, SUBJECT_MATCH_CONFIDENCE, BODY_MATCH_CONFIDENCE,
+    REPLY_GENERATION_WORKERS, REPLY_GENERATION_TIMEOUT
+)
 
 # Check if running in Streamlit
 is_streamlit = 'streamlit' in sys.modules or 'streamlit._is_running' in sys.modules or 'st' in globals()
@@ -50,16 +77,344 @@ SCOPES = ['https://www.googleapis.com/auth/gmail.modify',
 parser = argparse.ArgumentParser(description='Gmail Automation Tool')
 parser.add_argument('--no-prompt', action='store_true', help='Run without interactive prompts')
 parser.add_argument('--openai-key', type=str, help='OpenAI API key', default=None)
+parser.add_argument('--batch-size', type=int, help=f'Number of messages fetched per Gmail batch request (default: {GMAIL_BATCH_SIZE})', default=GMAIL_BATCH_SIZE)
+parser.add_argument('--fetch-mode', choices=['batch', 'concurrent', 'async'], help='Download messages with Gmail batch requests, concurrent individual requests, or the asyncio client (default: batch)', default='batch')
+parser.add_argument('--workers', type=int, help=f'Number of worker threads in concurrent fetch mode (default: {FETCH_WORKERS})', default=FETCH_WORKERS)
+parser.add_argument('--metadata-first', action='store_true', help='List emails from headers only and download bodies when they are needed')
+parser.add_argument('--max-emails', type=int, help='Maximum number of unread emails to sort, 0 for the whole unread backlog (default: 20)', default=20)
+parser.add_argument('--classifier', choices=['rules', 'model', 'embedding'], help='Classify emails with the keyword rules, the trained local model or the local embedding model (default: rules)', default='rules')
+parser.add_argument('--model-path', type=str, help='Path of the trained local classifier (default: emmy_model.npz next to this script)', default=None)
+parser.add_argument('--train-model', action='store_true', help='Train the local classifier from the classifications in the message store before sorting')
+parser.add_argument('--embedding-model', type=str, help='Directory of a local sentence-embedding model used by --classifier embedding', default=None)
+parser.add_argument('--body-scan-chars', type=int, help=f'Number of body characters scanned by the keyword rules, 0 to classify from subjects only (default: {BODY_SCAN_CHARS})', default=BODY_SCAN_CHARS)
+parser.add_argument('--torch-threads', type=int, help='Number of CPU threads used for embedding inference (default: torch default)', default=None)
+parser.add_argument('--reply-workers', type=int, help=f'Number of auto-responses generated at the same time (default: {REPLY_GENERATION_WORKERS})', default=REPLY_GENERATION_WORKERS)
+parser.add_argument('--reply-timeout', type=float, help=f'Seconds allowed for the OpenAI request of each auto-response, made once without retries; replies that fail or time out are not sent (default: {REPLY_GENERATION_TIMEOUT:g})', default=REPLY_GENERATION_TIMEOUT)
 args = parser.parse_args()
 
+# Assistants alive in this process; the WeakSet does not keep finished Streamlit sessions alive
+_live_assistants = weakref.WeakSet()
+
+
+@atexit.register
+def _save_learned_models():
+    """Write learned updates that are still waiting for their deferred save when the process exits."""
+    for assistant in list(_live_assistants):
+        assistant.save_text_model(force=True)
+
+
 class GmailAssistant:
-    def __init__(self):
+    def __init__(self, store_path=None, metadata_first=False, fetch_mode='batch', fetch_workers=FETCH_WORKERS,
+                 classifier_engine='rules', model_path=None, embedding_model_dir=None, torch_threads=None):
+        self.credentials = None  # set by authenticate()
         self.service = self.authenticate()
         self.user_id = 'me'  # 'me' refers to the authenticated user
         self.user_email = None
         self.openai_model = OPENAI_MODEL
         self.config = self.load_config()
+        self.batch_size = GMAIL_BATCH_SIZE
+        self.fetch_errors = {}  # message id -> fetch error, collected since the last sort_emails call
+        self.mailbox_sync = None
+        self.rate_limiter = shared_rate_limiter()
+        # Per-call-site partial response projections (see GMAIL_FIELD_MASKS)
+        self.field_masks = dict(GMAIL_FIELD_MASKS)
+        # Local data (store, sender index, response cache, learned model) of the authenticated account;
+        # none of it is opened before the account is known
+        self.data_dir = self.account_data_dir()
+        self.store = self.open_store(store_path)
+        self.sender_index = self.open_sender_index()
+        self.response_cache = self.open_response_cache()
+        # When set, listings only download Subject/From/Date and bodies are fetched on demand
+        self.metadata_first = metadata_first
+        # 'batch' sends message gets as Gmail batch requests, 'concurrent' runs them on a thread pool
+        self.fetch_mode = fetch_mode
+        self.fetch_workers = fetch_workers
+        self._fetch_pool = None
+        self._thread_local = threading.local()
+        self.label_queue = LabelChangeQueue(self)
+        # Keyword rules used by _classify_email; replace to change the rules
+        self.category_keywords = CATEGORY_KEYWORDS
+        # Only this many leading body characters are scanned by the keyword rules
+        self.body_scan_chars = BODY_SCAN_CHARS
+        # 'rules' classifies with category_keywords, 'model' with the trained local text model,
+        # 'embedding' with the nearest category centroid of a local sentence-embedding model
+        self.classifier_engine = classifier_engine
+        if model_path is None and self.data_dir:
+            model_path = os.path.join(self.data_dir, 'emmy_model.npz')
+        self.model_path = model_path
+        self.embedding_model_dir = embedding_model_dir
+        self.torch_threads = torch_threads
+        self.centroids_path = os.path.join(os.path.dirname(model_path), 'emmy_centroids.npz') if model_path else None
+        self._embedding_classifier = None
+        self.classification_cache = ClassificationCache()
+        self.text_model = self.load_text_model()
+        self._model_dirty = False
+        self._model_saved_at = 0.0
+        self._model_lock = threading.RLock()
+        self._model_save_timer = None
+        # Updates still waiting for their deferred save are written when the process exits. Until
+        # then the pending save timer holds the assistant, so they are not lost if it is dropped
+        _live_assistants.add(self)
+        # Concurrency and per-request timeout of generate_emails
+        self.reply_workers = REPLY_GENERATION_WORKERS
+        self.reply_timeout = REPLY_GENERATION_TIMEOUT
+        
+    def account_data_dir(self):
+        """Return the directory for the local data of the authenticated account, creating it if needed.
+        
+        Each Gmail address gets its own directory under emmy_data/ next to this script,
+        so Streamlit sessions signed in to different accounts never share stored
+        emails, sender history, cached responses or a learned model. Returns None if
+        the account cannot be identified (e.g. before OAuth has completed); the
+        assistant then works without local data and nothing is written to disk.
+        """
+        address = self.get_user_email() if self.service else ''
+        if not address:
+            print("[WARNING] Unknown Gmail account, local data will not be kept")
+            return None
+        account = re.sub(r'[^a-z0-9@._-]', '_', address.strip().lower())
+        path = os.path.join(os.path.dirname(__file__), 'emmy_data', account)
+        os.makedirs(path, exist_ok=True)
+        return path
+    
+    def open_store(self, store_path=None):
+        """Open the local message store, or return None if it cannot be used."""
+        if store_path is None and not self.data_dir:
+            return None
+        store_path = store_path or os.path.join(self.data_dir, 'emmy_messages.db')
+        try:
+            return MessageStore(store_path)
+        except Exception as e:
+            print(f"[WARNING] Local message store unavailable at {store_path}: {e}")
+            return None
+    
+    def open_sender_index(self):
+        """Open the sender reputation index next to the local store, or return None without a store."""
+        if not self.store:
+            return None
+        try:
+            return SenderIndex(self.store.path)
+        except Exception as e:
+            print(f"[WARNING] Sender index unavailable: {e}")
+            return None
+    
+    def open_response_cache(self):
+        """Open the cache of generated responses next to the local store, or return None without a store."""
+        if not self.store:
+            return None
+        try:
+            return ResponseCache(self.store.path)
+        except Exception as e:
+            print(f"[WARNING] Response cache unavailable: {e}")
+            return None
+    
+    def load_text_model(self):
+        """Load the trained local text classifier, or return None if there is none yet."""
+        if not self.model_path or not os.path.exists(self.model_path):
+            return None
+        try:
+            return NaiveBayesClassifier.load(self.model_path)
+        except Exception as e:
+            print(f"[WARNING] Could not load text classifier from {self.model_path}: {e}")
+            return None
+    
+    def train_text_model(self, email_infos=None, labels=None, save=True):
+        """Train the local text classifier and use it from now on.
+        
+        Without explicit training data the model is fit on the emails in the local
+        store, labeled with their stored categories (emails filed under needs_review
+        or rules_in_training are skipped). Returns the trained model.
+        """
+        if email_infos is None:
+            email_infos, labels = [], []
+            if self.store:
+                for chunk in self.store.iter_labeled():
+                    for email_info, category in chunk:
+                        if category not in ('needs_review', 'rules_in_training'):
+                            email_infos.append(email_info)
+                            labels.append(category)
+        
+        model = self.text_model or NaiveBayesClassifier()
+        model.fit([email_text(email_info) for email_info in email_infos], labels)
+        self.text_model = model
+        if save and self.model_path:
+            model.save(self.model_path)
+        return model
+    
+    def learn_from_action(self, email_info, category=None):
+        """Update the text model in place from a user action on an email.
+        
+        `category` is the category the user chose for the email; by default it is the
+        category the email is filed under, so replying to or marking an email read
+        confirms that category. Emails in needs_review or rules_in_training confirm
+        nothing. The update costs O(features of one email), and the model file is
+        saved at most every MODEL_SAVE_INTERVAL seconds. Returns True if the model learned.
+        """
+        if category is None and self.mailbox_sync:
+            category = self.mailbox_sync.locations.get(email_info['id'])
+        if category in (None, 'needs_review', 'rules_in_training'):
+            return False
         
+        with self._model_lock:
+            if self.text_model is None:
+                self.text_model = NaiveBayesClassifier()
+            self.text_model.partial_fit([email_text(email_info)], [category])
+            self._model_dirty = True
+            self.save_text_model()
+        return True
+    
+    def save_text_model(self, force=False):
+        """Save the text model if it changed.
+        
+        Unless force is set, a model saved less than MODEL_SAVE_INTERVAL seconds ago
+        is not written again right away; a save is scheduled for the end of the
+        interval instead, so later updates are not lost.
+        """
+        with self._model_lock:
+            if not self._model_dirty or self.text_model is None or not self.model_path:
+                return
+            wait = MODEL_SAVE_INTERVAL - (time.monotonic() - self._model_saved_at)
+            if not force and wait > 0:
+                if self._model_save_timer is None:
+                    self._model_save_timer = threading.Timer(wait, self._deferred_model_save)
+                    self._model_save_timer.daemon = True
+                    self._model_save_timer.start()
+                return
+            try:
+                self.text_model.save(self.model_path)
+            except Exception as e:
+                print(f"[WARNING] Could not save text classifier to {self.model_path}: {e}")
+                return
+            self._model_dirty = False
+            self._model_saved_at = time.monotonic()
+    
+    def _deferred_model_save(self):
+        """Timer callback of save_text_model: write the updates made since the last save."""
+        with self._model_lock:
+            self._model_save_timer = None
+            self.save_text_model(force=True)
+    
+    def recategorize(self, email_info, category):
+        """File an email under another category at the user's request and learn from the correction."""
+        self.learn_from_action(email_info, category)
+        self.classification_cache.put(email_info['id'], self.classification_version(), (category, 1.0))
+        if self.mailbox_sync:
+            self.mailbox_sync.move(email_info, category)
+        if self.store:
+            self.store.update_categories([(email_info['id'], category, 1.0)], USER_VERSION)
+        if self.sender_index:
+            # The sender's history no longer predicts its category; start it over from the correction
+            address = self.extract_email(email_info['sender'])
+            self.sender_index.forget(address)
+            self.sender_index.observe(address, category)
+            self.sender_index.flush()
+    
+    def _learning_active(self):
+        """True when the learned model has seen enough examples, of enough categories, to second-guess the keyword rules."""
+        if self.classifier_engine != 'rules' or self.text_model is None:
+            return False
+        class_counts = self.text_model.class_counts
+        return (
+            class_counts.sum() >= ONLINE_LEARNING_MIN_EXAMPLES
+            and (class_counts >= ONLINE_LEARNING_MIN_CLASS_EXAMPLES).sum() >= ONLINE_LEARNING_MIN_CLASSES
+        )
+    
+    def _learned_prediction(self, email_info):
+        """Return the learned (category, confidence) for an email if it may overrule the keyword rules, else None."""
+        if not self._learning_active():
+            return None
+        category, confidence = self.text_model.predict(email_text(email_info))
+        if confidence < ONLINE_LEARNING_MIN_CONFIDENCE:
+            return None
+        # A category learned from a handful of emails is not evidence enough against the rules
+        if self.text_model.class_counts[self.text_model.classes.index(category)] < ONLINE_LEARNING_MIN_CLASS_EXAMPLES:
+            return None
+        return category, confidence
+    
+    def get_embedding_classifier(self):
+        """Load the embedding classifier on first use, or return None if it is unavailable.
+        
+        Centroids trained with train_embedding_centroids() are used when present;
+        otherwise they are computed from the keyword rules.
+        """
+        if self._embedding_classifier is None and self.embedding_model_dir:
+            try:
+                classifier = EmbeddingClassifier(self.embedding_model_dir, num_threads=self.torch_threads)
+                try:
+                    if not self.centroids_path:
+                        raise FileNotFoundError('no local data for this account')
+                    classifier.load_centroids(self.centroids_path)
+                except (OSError, ValueError):
+                    classifier.fit_keywords(self.category_keywords)
+                self._embedding_classifier = classifier
+            except Exception as e:
+                print(f"[WARNING] Embedding classifier unavailable ({self.embedding_model_dir}): {e}")
+                self.embedding_model_dir = None
+        return self._embedding_classifier
+    
+    def train_embedding_centroids(self, save=True):
+        """Recompute the embedding centroids from the categories in the local store."""
+        classifier = self.get_embedding_classifier()
+        if classifier is None or not self.store:
+            return None
+        email_infos, labels = [], []
+        for chunk in self.store.iter_labeled():
+            for email_info, category in chunk:
+                if category not in ('needs_review', 'rules_in_training'):
+                    email_infos.append(email_info)
+                    labels.append(category)
+        if not email_infos:
+            return classifier
+        classifier.fit(email_infos, labels)
+        if save and self.centroids_path:
+            classifier.save_centroids(self.centroids_path)
+        return classifier
+    
+    def _use_embeddings(self):
+        """True when emails should be classified by the embedding classifier."""
+        if self.classifier_engine != 'embedding':
+            return False
+        classifier = self.get_embedding_classifier()
+        return classifier is not None and classifier.ready
+    
+    def rules_version(self):
+        """Return a string identifying the classifier engine, keyword rules and trained model in use.
+        
+        Unlike classification_version it does not change when the text model learns
+        online from a user action (which resets that sender's history instead), only
+        when the model is retrained or other centroids are used. It identifies the
+        classifier that outcomes recorded in the sender index come from.
+        """
+        parts = [self.classifier_engine, get_keyword_matcher(self.category_keywords).fingerprint, f"body-{self.body_scan_chars}"]
+        if self._use_embeddings():
+            parts.append(self._embedding_classifier.fingerprint)
+        elif self._use_text_model():
+            parts.append(f"fit-{self.text_model.fit_version}")
+        return ':'.join(parts)
+    
+    def classification_version(self):
+        """Return a string identifying the rules and model that currently classify emails.
+        
+        It changes whenever the keyword rules are edited, the engine is switched, or
+        the text model or embedding centroids in use are retrained or updated.
+        """
+        parts = [self.rules_version()]
+        if self._use_text_model() or self._learning_active():
+            parts.append(f"model-{self.text_model.version}")
+        return ':'.join(parts)
+    
+    def _use_text_model(self):
+        """True when emails should be classified by the trained local model."""
+        return self.classifier_engine == 'model' and self.text_model is not None and self.text_model.trained
+    
+    def _execute(self, request, method):
+        """Execute a Gmail API request under the shared quota limiter, retrying throttled calls."""
+        return self.rate_limiter.execute(request, method)
+    
+    def _fields(self, call_site):
+        """Return the partial-response field mask for a Gmail call site, or None for the full response."""
+        return self.field_masks.get(call_site)
+    
     def load_config(self):
         """Load configuration from Streamlit secrets or fallback to defaults."""
         try:
@@ -141,6 +496,7 @@ class GmailAssistant:
                             st.session_state.google_creds['token'] = creds.token
                         
                         # Build and return service
+                        self.credentials = creds
                         service = build('gmail', 'v1', credentials=creds)
                         return service
                     
@@ -177,6 +533,7 @@ class GmailAssistant:
                         st.query_params.clear()
                         
                         # Build and return service
+                        self.credentials = creds
                         service = build('gmail', 'v1', credentials=creds)
                         return service
                     
@@ -218,6 +575,7 @@ class GmailAssistant:
                         pickle.dump(creds, token)
                 
                 # Build the service
+                self.credentials = creds
                 service = build('gmail', 'v1', credentials=creds)
                 return service
                     
@@ -225,75 +583,364 @@ class GmailAssistant:
             print(f"[ERROR] Authentication error: {e}")
             return None
 
-    def get_unread_emails(self, max_results=10):
+    def get_unread_emails(self, max_results=10, batch_size=None):
         """Get a list of unread emails."""
         try:
-            response = self.service.users().messages().list(
+            return list(self.iter_unread_emails(max_results=max_results, batch_size=batch_size))
+        except Exception as e:
+            print(f'Error retrieving emails: {e}')
+            return []
+    
+    def iter_unread_emails(self, max_results=None, page_size=GMAIL_PAGE_SIZE, batch_size=None):
+        """Yield unread emails page by page, newest first.
+        
+        Follows nextPageToken until the mailbox is exhausted or max_results emails
+        have been listed (max_results=None means no cap). Only one page of messages
+        is held in memory at a time.
+        """
+        for message_ids in self.iter_unread_pages(max_results=max_results, page_size=page_size):
+            yield from self.get_messages(message_ids, batch_size=batch_size)
+    
+    def iter_unread_pages(self, max_results=None, page_size=GMAIL_PAGE_SIZE):
+        """Yield lists of unread message IDs, one list per messages().list page."""
+        page_token = None
+        remaining = max_results
+        
+        while remaining is None or remaining > 0:
+            request_size = min(page_size, 500) if remaining is None else min(page_size, 500, remaining)
+            response = self._execute(self.service.users().messages().list(
                 userId=self.user_id,
                 q='is:unread',
-                maxResults=max_results
-            ).execute()
+                maxResults=request_size,
+                pageToken=page_token,
+                fields=self._fields('messages.list')
+            ), 'messages.list')
             
-            if 'messages' not in response:
-                return []
+            message_ids = [msg['id'] for msg in response.get('messages', [])]
+            if remaining is not None:
+                message_ids = message_ids[:remaining]
+                remaining -= len(message_ids)
+            if message_ids:
+                yield message_ids
             
-            messages = []
-            for msg in response['messages']:
-                message = self.service.users().messages().get(
-                    userId=self.user_id,
-                    id=msg['id'],
-                    format='full'
-                ).execute()
-                
-                messages.append(message)
+            page_token = response.get('nextPageToken')
+            if not page_token or not message_ids:
+                return
+    
+    def list_unread_ids(self, max_results=10):
+        """Get the IDs of unread emails, newest first."""
+        return [message_id for page in self.iter_unread_pages(max_results=max_results) for message_id in page]
+    
+    def load_emails(self, message_ids):
+        """Return (email_info, category) pairs for message_ids, in order.
+        
+        Emails already in the local store are served from it; only unseen IDs are
+        downloaded, parsed, classified and then saved to the store.
+        """
+        cached = self.store.get_many(message_ids) if self.store else {}
+        missing = [message_id for message_id in message_ids if message_id not in cached]
+        
+        message_format = 'metadata' if self.metadata_first else 'full'
+        loaded = self._process_messages(self.get_messages(missing, format=message_format) if missing else [])
+        
+        if cached:
+            print(f"[DEBUG] Served {len(cached)} emails from the local store, fetched {len(missing)}")
+        
+        return self._merge_loaded(message_ids, cached, loaded)
+    
+    def _process_messages(self, messages):
+        """Parse and classify downloaded messages and save them to the store; returns {id: (email_info, category)}."""
+        loaded = {}
+        new_entries = []
+        email_infos = [self.extract_email_info(message, include_body=not self.metadata_first) for message in messages]
+        if self._use_embeddings():
+            # Embed the whole page in padded batches; _categorize then reads the cached embeddings
+            self._embedding_classifier.embed_emails(email_infos)
+        
+        version = self.classification_version()
+        if self.sender_index:
+            # Outcomes of other rules or another engine must not file these emails
+            self.sender_index.set_version(self.rules_version())
+        for message, email_info in zip(messages, email_infos):
+            category, confidence = self._categorize_new(email_info, version)
+            loaded[message['id']] = (email_info, category)
+            new_entries.append((email_info, category, confidence, message.get('internalDate'), message.get('historyId')))
+        
+        if self.sender_index and new_entries:
+            try:
+                self.sender_index.flush()
+            except Exception as e:
+                print(f"[WARNING] Could not save the sender index: {e}")
+        if self.store and new_entries:
+            try:
+                self.store.put_many(new_entries, version)
+            except Exception as e:
+                print(f"[WARNING] Could not save emails to the local store: {e}")
+        return loaded
+    
+    def _merge_loaded(self, message_ids, cached, loaded):
+        """Combine stored and freshly loaded emails into (email_info, category) pairs in message_ids order.
+        
+        Stored emails classified by older rules or models are reclassified, and the
+        store is updated with their new categories.
+        """
+        version = self.classification_version()
+        results = []
+        refreshed = []
+        for message_id in message_ids:
+            if message_id in cached:
+                email_info, category, _, stored_version = cached[message_id]
+                if stored_version not in (version, USER_VERSION):
+                    category, confidence = self._categorize(email_info, version)
+                    refreshed.append((message_id, category, confidence))
+                results.append((email_info, category))
+            elif message_id in loaded:
+                results.append(loaded[message_id])
+        
+        if refreshed:
+            try:
+                self.store.update_categories(refreshed, version)
+            except Exception as e:
+                print(f"[WARNING] Could not update stored classifications: {e}")
+        return results
+    
+    def get_messages(self, message_ids, format='full', batch_size=None):
+        """Fetch messages by ID, keeping the order of message_ids.
+        
+        Uses Gmail batch requests, or a bounded pool of worker threads when
+        fetch_mode is 'concurrent'. With format='metadata' only the METADATA_HEADERS
+        are downloaded. Messages that fail to download are left out of the result
+        and added to self.fetch_errors instead of failing the whole fetch; errors
+        of earlier calls are kept, so a caller fetching several pages sees them all.
+        """
+        previous_errors, self.fetch_errors = self.fetch_errors, {}
+        
+        if self.fetch_mode == 'concurrent' and self.credentials is not None:
+            results = self._fetch_concurrently(message_ids, format)
+        else:
+            results = self._fetch_in_batches(message_ids, format, batch_size)
+        
+        for message_id, error in self.fetch_errors.items():
+            print(f"[WARNING] Failed to fetch message {message_id}: {error}")
+        for index in results:
+            previous_errors.pop(message_ids[index], None)
+        previous_errors.update(self.fetch_errors)
+        self.fetch_errors = previous_errors
+        
+        return [results[index] for index in range(len(message_ids)) if index in results]
+    
+    def _fetch_in_batches(self, message_ids, format, batch_size=None):
+        """Fetch messages through Gmail batch requests; returns {index: message}.
+        
+        Sub-requests that are throttled or hit a transient server error are sent
+        again in a later batch after backing off.
+        """
+        batch_size = max(1, min(batch_size or self.batch_size, 100))
+        limiter = self.rate_limiter
+        results = {}
+        pending = list(range(len(message_ids)))
+        
+        for attempt in range(limiter.max_retries + 1):
+            retry = []
+            final_attempt = attempt == limiter.max_retries
+            
+            def on_response(request_id, response, exception):
+                index = int(request_id)
+                if exception is None:
+                    results[index] = response
+                elif not final_attempt and limiter.should_retry_error('messages.get', exception):
+                    retry.append((index, exception))
+                else:
+                    self.fetch_errors[message_ids[index]] = exception
+            
+            for start in range(0, len(pending), batch_size):
+                chunk = pending[start:start + batch_size]
+                batch = self.service.new_batch_http_request(callback=on_response)
+                for index in chunk:
+                    batch.add(self._get_message_request(message_ids[index], format), request_id=str(index))
                 
-            return messages
+                limiter.acquire('messages.get', count=len(chunk))
+                try:
+                    batch.execute()
+                except Exception as e:
+                    # The batch request itself failed - retry or record every message in this chunk
+                    for index in chunk:
+                        if index in results:
+                            continue
+                        if not final_attempt and limiter.should_retry_error('messages.get', e):
+                            retry.append((index, e))
+                        else:
+                            self.fetch_errors.setdefault(message_ids[index], e)
+            
+            if not retry:
+                break
+            
+            pending = sorted({index for index, _ in retry})
+            error = retry[0][1]
+            time.sleep(limiter.backoff('messages.get', attempt, error.resp.status, error.resp.get('retry-after')))
+        
+        return results
+    
+    def _fetch_concurrently(self, message_ids, format):
+        """Fetch messages with individual requests on the worker pool; returns {index: message}."""
+        pool = self._get_fetch_pool()
+        futures = [
+            pool.submit(lambda message_id=message_id: self._execute(self._get_message_request(
+                message_id, format, service=self._thread_service()), 'messages.get'))
+            for message_id in message_ids
+        ]
+        
+        results = {}
+        for index, future in enumerate(futures):
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                self.fetch_errors[message_ids[index]] = e
+        return results
+    
+    def _get_fetch_pool(self):
+        """Return the worker pool for concurrent fetches, resizing it if fetch_workers changed."""
+        if self._fetch_pool is None or self._fetch_pool._max_workers != self.fetch_workers:
+            if self._fetch_pool is not None:
+                self._fetch_pool.shutdown(wait=False)
+            self._fetch_pool = ThreadPoolExecutor(max_workers=self.fetch_workers, thread_name_prefix='gmail-fetch')
+        return self._fetch_pool
+    
+    def _thread_service(self):
+        """Return a Gmail service owned by the calling thread.
+        
+        googleapiclient services share one httplib2 transport that is not
+        thread-safe, so each worker builds its own from the same credentials.
+        """
+        service = getattr(self._thread_local, 'service', None)
+        if service is None:
+            service = build('gmail', 'v1', credentials=self.credentials, cache_discovery=False)
+            self._thread_local.service = service
+        return service
+    
+    def _get_message_request(self, message_id, format='full', service=None):
+        """Build a messages().get request for one message."""
+        service = service or self.service
+        if format == 'metadata':
+            return service.users().messages().get(
+                userId=self.user_id,
+                id=message_id,
+                format='metadata',
+                metadataHeaders=METADATA_HEADERS,
+                fields=self._fields('messages.get.metadata')
+            )
+        return service.users().messages().get(
+            userId=self.user_id,
+            id=message_id,
+            format=format,
+            fields=self._fields('messages.get')
+        )
+    
+    def ensure_body(self, email_info):
+        """Download the body of an email listed in metadata-first mode, if not loaded yet."""
+        if email_info.get('body') is not None:
+            return email_info['body']
+        
+        try:
+            message = self._execute(self._get_message_request(email_info['id']), 'messages.get')
+            email_info['body'] = self.extract_email_info(message)['body']
         except Exception as e:
-            print(f'Error retrieving emails: {e}')
-            return []
+            print(f"Error loading email body: {e}")
+            return ''
+        
+        if self.store:
+            try:
+                self.store.update_body(email_info['id'], email_info['body'])
+            except Exception as e:
+                print(f"[WARNING] Could not save email body to the local store: {e}")
+        return email_info['body']
     
-    def extract_email_info(self, message):
-        """Extract subject, sender, and content from an email message."""
-        headers = message['payload']['headers']
-        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-        sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
-        
-        # Extract email body
-        parts = message['payload'].get('parts', [])
-        body = ''
-        
-        if 'body' in message['payload'] and 'data' in message['payload']['body']:
-            # Handle single part messages
-            body = base64.urlsafe_b64decode(message['payload']['body']['data']).decode('utf-8')
-        elif parts:
-            # Handle multipart messages
-            for part in parts:
-                if part.get('mimeType') == 'text/plain' and 'data' in part.get('body', {}):
-                    body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-                    break
+    def ensure_bodies(self, emails):
+        """Download the bodies of emails listed in metadata-first mode in one get_messages call.
         
-        return {
-            'id': message['id'],
-            'subject': subject,
-            'sender': sender,
-            'body': body,
-            'date': self._get_date(headers)
-        }
+        Emails whose body is already loaded are left alone; an email whose body
+        fails to download keeps body None and is recorded in self.fetch_errors.
+        """
+        missing = [email_info for email_info in emails if email_info.get('body') is None]
+        if not missing:
+            return
+        
+        try:
+            messages = self.get_messages([email_info['id'] for email_info in missing])
+        except Exception as e:
+            print(f"Error loading email bodies: {e}")
+            return
+        bodies = {message['id']: self.extract_email_info(message)['body'] for message in messages}
+        for email_info in missing:
+            if email_info['id'] in bodies:
+                email_info['body'] = bodies[email_info['id']]
+        
+        if self.store and bodies:
+            try:
+                self.store.update_bodies(bodies.items())
+            except Exception as e:
+                print(f"[WARNING] Could not save email bodies to the local store: {e}")
+    
+    def extract_email_info(self, message, include_body=True):
+        """Extract subject, sender, and content from an email message.
+        
+        With include_body=False (metadata-only messages) the body is set to None
+        until it is loaded with ensure_body.
+        """
+        headers = header_index(message['payload']['headers'])
+        subject = headers.get('subject', 'No Subject')
+        sender = headers.get('from', 'Unknown Sender')
+        
+        # Extract email body: the first text/plain part anywhere in the MIME tree, else the text of the first HTML part
+        body = None
+        if include_body:
+            plain_part, html_part = find_text_parts(message['payload'])
+            if plain_part:
+                body = decode_part(plain_part)
+            elif html_part:
+                # HTML-only email: keep the visible text so replies and classification get context
+                body = html_to_text(decode_part(html_part))
+            else:
+                body = ''
+        
+        return EmailInfo(
+            id=message['id'],
+            subject=subject,
+            sender=sender,
+            body=body,
+            snippet=message.get('snippet', ''),
+            date=message_date(headers, message.get('internalDate'))
+        )
     
-    def _get_date(self, headers):
-        """Extract date from email headers."""
-        date_str = next((h['value'] for h in headers if h['name'] == 'Date'), '')
+    def sort_emails(self, max_results=20, incremental=False, page_size=GMAIL_PAGE_SIZE):
+        """Sort emails into categories based on advanced rule-based logic.
+        
+        Unread emails are streamed page by page, so max_results=None sorts the whole
+        unread backlog without holding every raw message in memory. With
+        incremental=True the categorized view is kept between calls and only the
+        mailbox changes since the previous call are fetched (see MailboxSync).
+        Messages that could not be downloaded are in self.fetch_errors afterwards.
+        """
+        self.fetch_errors = {}
+        if incremental:
+            if self.mailbox_sync is None:
+                self.mailbox_sync = MailboxSync(self, max_results=max_results)
+            return self.mailbox_sync.sync()
+        
+        categories = self._empty_categories()
+        
         try:
-            if date_str:
-                # This is a simple conversion, might need to be more robust for different date formats
-                return datetime.strptime(date_str.split(' +')[0], '%a, %d %b %Y %H:%M:%S')
-        except Exception:
-            pass
-        return datetime.now()
-    
-    def sort_emails(self, max_results=20):
-        """Sort emails into categories based on advanced rule-based logic."""
-        categories = {
+            for message_ids in self.iter_unread_pages(max_results=max_results, page_size=page_size):
+                for email_info, category in self.load_emails(message_ids):
+                    categories[category].append(email_info)
+        except Exception as e:
+            print(f'Error retrieving emails: {e}')
+        
+        return categories
+    
+    def _empty_categories(self):
+        """Return an empty category -> emails mapping in display order."""
+        return {
             'priority_inbox': [],
             'main_inbox': [],
             'urgent_alerts': [],
@@ -307,90 +954,260 @@ class GmailAssistant:
             'needs_review': [],
             'rules_in_training': []
         }
+    
+    def _categorize_new(self, email_info, version=None):
+        """Categorize a newly downloaded email, taking the sender fast path when its history is stable.
         
-        unread_emails = self.get_unread_emails(max_results=max_results)
+        Emails from a sender or domain that the sender index knows to be stable are
+        filed under its usual category without classification; every other email is
+        classified and its category is recorded in the index. The fast path is still
+        second-guessed by the model learned from user actions, like the rules are.
+        """
+        if not self.sender_index:
+            return self._categorize(email_info, version)
         
-        for email in unread_emails:
-            email_info = self.extract_email_info(email)
-            classifications = self._classify_email(email_info)
-            
-            # Debug statement to print classifications for specific subjects
-            if "warning" in email_info['subject'].lower() or "error" in email_info['subject'].lower() or "critical" in email_info['subject'].lower():
-                print(f"Classification for '{email_info['subject']}': {classifications}")
+        address = email_info['sender_address']
+        fast_path = self.sender_index.lookup(address)
+        if fast_path is not None:
+            learned = self._learned_prediction(email_info)
+            if learned is not None and learned[0] != fast_path[0]:
+                return 'rules_in_training', learned[1]
+            return fast_path
+        category, confidence = self._categorize(email_info, version)
+        self.sender_index.observe(address, category)
+        return category, confidence
+    
+    def _categorize(self, email_info, version=None):
+        """Return the (category, confidence) an email should be filed under.
+        
+        Results are cached per message and classifier version (see classification_version),
+        so classifying an unchanged email again under unchanged rules does no work.
+        """
+        message_id = email_info.get('id')
+        if message_id is not None:
+            version = version or self.classification_version()
+            cached = self.classification_cache.get(message_id, version)
+            if cached is not None:
+                return cached
+        
+        result = self._categorize_uncached(email_info)
+        if message_id is not None:
+            self.classification_cache.put(message_id, version, result)
+        return result
+    
+    def _categorize_uncached(self, email_info):
+        """Classify an email without consulting the classification cache."""
+        classifications = self._classify_email(email_info)
+        
+        # Debug statement to print classifications for specific subjects
+        if "warning" in email_info['subject'].lower() or "error" in email_info['subject'].lower() or "critical" in email_info['subject'].lower():
+            print(f"Classification for '{email_info['subject']}': {classifications}")
+        
+        # If email matches multiple categories, use the highest confidence one
+        if classifications:
+            best_match = max(classifications, key=lambda x: x[1])
+            category, confidence = best_match
             
-            # If email matches multiple categories, use the highest confidence one
-            if classifications:
-                best_match = max(classifications, key=lambda x: x[1])
-                category, confidence = best_match
-                
-                # If confidence is too low, put in needs_review
-                if confidence < 0.6:
-                    categories['needs_review'].append(email_info)
-                else:
-                    categories[category].append(email_info)
-            else:
-                # If no classification matches, put in needs_review
-                categories['needs_review'].append(email_info)
+            # If confidence is too low, put in needs_review
+            if confidence < 0.6:
+                category = 'needs_review'
+        else:
+            # If no classification matches, put in needs_review
+            category, confidence = 'needs_review', 0.0
         
-        return categories
+        # Emails the model learned from user actions would file elsewhere go to rules_in_training
+        learned = self._learned_prediction(email_info)
+        if learned is not None and learned[0] != category:
+            return 'rules_in_training', learned[1]
+        return category, confidence
     
     def _classify_email(self, email_info):
         """
-        Analyze email subject and return list of (category, confidence) tuples based on keyword matching.
+        Analyze email subject and body and return list of (category, confidence) tuples based on keyword matching.
+        
+        Subject and body hits are weighted separately (SUBJECT_MATCH_CONFIDENCE, and BODY_MATCH_CONFIDENCE
+        per distinct body keyword), and only the first body_scan_chars characters of the body are scanned.
+        One or two body keywords alone stay below the needs_review threshold of _categorize; several
+        distinct keywords of one category file the email even without a subject match. If categories
+        matched by the body alone tie for the best confidence, the email goes to needs_review.
+        
+        With the 'model' engine the confidences are the trained model's class probabilities instead,
+        and with the 'embedding' engine the calibrated probabilities of each category centroid
+        (see EmbeddingClassifier.probabilities).
         """
+        if self._use_embeddings():
+            probabilities = self._embedding_classifier.probabilities([email_info])[0]
+            return sorted(zip(self._embedding_classifier.categories, probabilities.tolist()), key=lambda x: x[1], reverse=True)
+        
+        if self._use_text_model():
+            probabilities = self.text_model.predict_proba(email_text(email_info))
+            return sorted(zip(self.text_model.classes, probabilities.tolist()), key=lambda x: x[1], reverse=True)
+        
         classifications = []
-        subject = email_info['subject'].lower()
-        
-        # Define keywords for each category
-        category_keywords = {
-            'priority_inbox': ['follow up', 'question', 'need', 'asap', 'approve', 'feedback', 'waiting on', 'deadline', 'important'],
-            'main_inbox': ['update', 'information', 'hello', 'hi', 'greetings', 'thanks', 'thank you'],
-            'urgent_alerts': ['warning', 'critical', 'error', 'alert', 'urgent', 'failed', 'down', 'issue', 'emergency', 'breach'],
-            'basic_alerts': ['report', 'summary', 'update', 'daily stats', 'weekly stats', 'monthly stats', 'notification'],
-            'fyi_cc': ['fyi', 'for your information', 'just letting you know', 'for your awareness', 'in case you missed'],
-            'billing_finance': ['invoice', 'payment', 'receipt', 'subscription', 'charge', 'statement', 'bill', 'transaction', 'finance'],
-            'scheduling_calendars': ['invite', 'meeting', 'calendar', 'schedule', 'appointment', 'call', 'booking', 'zoom', 'google meet', 'teams'],
-            'marketing_promotions': ['webinar', 'deal', 'promo', 'save', 'limited time', 'offer', 'discount', 'subscribe', 'newsletter'],
-            'team_internal': ['team', 'internal', 'quick question', 'can you check', 'office'],
-            'projects_clients': ['project', 'client', 'proposal', 'deliverable', 'scope', 'contract']
-        }
         
-        # Simple matching based on subject keywords only
-        for category, keywords in category_keywords.items():
-            for keyword in keywords:
-                if keyword in subject:
-                    # Add category with fixed confidence
-                    classifications.append((category, 0.8))
-                    break  # Stop after first match in a category
+        # Single pass over the subject and one over the body prefix, with the compiled matcher shared by all assistants
+        matcher = get_keyword_matcher(self.category_keywords)
+        subject_hits = set(matcher.categories(email_info['subject']))
+        body_hits = matcher.find(self._body_prefix(email_info))
+        for category in matcher.category_names:
+            if category in subject_hits or category in body_hits:
+                body_keywords = len(set(body_hits.get(category, ())))
+                classifications.append((category, self._match_confidence(category in subject_hits, body_keywords)))
         
         # If no classification found, mark as needs_review
         if not classifications:
             classifications.append(('needs_review', 0.7))
-            
+            return classifications
+        
+        # Body-only evidence that fits several categories equally well decides nothing
+        top = max(confidence for _, confidence in classifications)
+        best = [category for category, confidence in classifications if confidence == top]
+        if len(best) > 1 and best[0] not in subject_hits:
+            return [('needs_review', top)]
         return classifications
     
+    def _body_prefix(self, email_info):
+        """Return the part of the body scanned by the keyword rules.
+        
+        At most body_scan_chars characters are kept, cut back to the last whole word,
+        so classification cost does not grow with the size of the body. Emails listed
+        from metadata only fall back to the snippet Gmail sends with the headers.
+        """
+        body = email_info.get('body')
+        if body is None:
+            body = email_info.get('snippet') or ''
+        if len(body) <= self.body_scan_chars:
+            return body
+        prefix = body[:self.body_scan_chars]
+        if not body[self.body_scan_chars].isspace():
+            # Drop the word cut in half, so it cannot match as a shorter keyword
+            words = prefix.rsplit(None, 1)
+            if len(words) > 1:
+                prefix = words[0]
+        return prefix
+    
+    def _match_confidence(self, in_subject, body_keywords):
+        """Return the confidence of a keyword match in the subject and/or of body_keywords distinct body keywords."""
+        miss = (1.0 - BODY_MATCH_CONFIDENCE) ** body_keywords
+        if in_subject:
+            miss *= 1.0 - SUBJECT_MATCH_CONFIDENCE
+        return 1.0 - miss
+    
+    def classify_batch(self, email_infos, chunk_size=10000):
+        """Classify many emails at once from their subjects and body prefixes.
+        
+        Returns (categories, confidences) as NumPy arrays aligned with email_infos,
+        using the same rules and tie-breaking as _classify_email and _categorize.
+        Keyword hits for a chunk are scored against all categories in one matrix
+        product, which keeps large backfills out of per-email Python loops.
+        With the 'model' engine each email is scored by the trained model instead,
+        and with the 'embedding' engine the chunk is embedded in padded batches.
+        """
+        if self._use_embeddings():
+            return self._classify_batch_with_embeddings(email_infos, chunk_size)
+        if self._use_text_model():
+            return self._classify_batch_with_model(email_infos)
+        
+        matcher = get_keyword_matcher(self.category_keywords)
+        names = np.array(matcher.category_names + ['needs_review'], dtype=object)
+        categories = np.empty(len(email_infos), dtype=object)
+        confidences = np.empty(len(email_infos), dtype=np.float32)
+        
+        for start in range(0, len(email_infos), chunk_size):
+            chunk = email_infos[start:start + chunk_size]
+            subject_hits = matcher.score_batch([email_info['subject'] for email_info in chunk]) > 0
+            body_keywords = matcher.score_batch([self._body_prefix(email_info) for email_info in chunk], distinct=True)
+            scores = 1.0 - (1.0 - SUBJECT_MATCH_CONFIDENCE * subject_hits) * (1.0 - BODY_MATCH_CONFIDENCE) ** body_keywords
+            matched = scores.any(axis=1)
+            # argmax returns the first best category, matching the rule-order tie-breaking of _categorize
+            best_hit = scores.argmax(axis=1) if scores.shape[1] else np.zeros(len(chunk), dtype=np.intp)
+            # Like _categorize, matches below the 0.6 threshold go to needs_review, and so do
+            # body-only matches tied with another category
+            filed = matched & (scores.max(axis=1) >= 0.6) if scores.shape[1] else matched
+            if scores.shape[1]:
+                tied = (scores == scores.max(axis=1, keepdims=True)).sum(axis=1) > 1
+                filed &= ~(tied & ~subject_hits[np.arange(len(chunk)), best_hit])
+            best = np.where(filed, best_hit, len(names) - 1)
+            categories[start:start + len(chunk)] = names[best]
+            confidences[start:start + len(chunk)] = np.where(
+                matched, scores.max(axis=1) if scores.shape[1] else 0.0, 0.7
+            )
+        
+        if self._learning_active():
+            for index, email_info in enumerate(email_infos):
+                learned = self._learned_prediction(email_info)
+                if learned is not None and learned[0] != categories[index]:
+                    categories[index], confidences[index] = 'rules_in_training', learned[1]
+        
+        return categories, confidences
+    
+    def _classify_batch_with_embeddings(self, email_infos, chunk_size):
+        """classify_batch for the 'embedding' engine, applying the same needs_review threshold as _categorize."""
+        classifier = self._embedding_classifier
+        categories = np.empty(len(email_infos), dtype=object)
+        confidences = np.empty(len(email_infos), dtype=np.float32)
+        for start in range(0, len(email_infos), chunk_size):
+            for index, (category, confidence) in enumerate(classifier.predict(email_infos[start:start + chunk_size]), start):
+                categories[index] = category if confidence >= 0.6 else 'needs_review'
+                confidences[index] = confidence
+        return categories, confidences
+    
+    def _classify_batch_with_model(self, email_infos):
+        """classify_batch for the 'model' engine, applying the same needs_review threshold as _categorize."""
+        categories = np.empty(len(email_infos), dtype=object)
+        confidences = np.empty(len(email_infos), dtype=np.float32)
+        for index, email_info in enumerate(email_infos):
+            category, confidence = self.text_model.predict(email_text(email_info))
+            categories[index] = category if confidence >= 0.6 else 'needs_review'
+            confidences[index] = confidence
+        return categories, confidences
+    
+    def reclassify_store(self, chunk_size=10000):
+        """Re-run classification over every email in the local store (keeping categories chosen by the user); returns the number processed."""
+        if not self.store:
+            return 0
+        
+        version = self.classification_version()
+        updated = 0
+        for email_infos in self.store.iter_emails(chunk_size=chunk_size):
+            categories, confidences = self.classify_batch(email_infos, chunk_size=chunk_size)
+            self.store.update_categories(
+                (
+                    (email_info['id'], category, float(confidence))
+                    for email_info, category, confidence in zip(email_infos, categories, confidences)
+                ),
+                version
+            )
+            updated += len(email_infos)
+        return updated
+    
     def create_draft(self, to, subject, body):
         """Create a draft email."""
         try:
-            message = MIMEMultipart()
-            message['to'] = to
-            message['subject'] = subject
+            raw_message = self._build_raw_message(to, subject, body)
             
-            msg = MIMEText(body)
-            message.attach(msg)
-            
-            raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
-            
-            draft = self.service.users().drafts().create(
+            draft = self._execute(self.service.users().drafts().create(
                 userId=self.user_id,
-                body={'message': {'raw': raw_message}}
-            ).execute()
+                body={'message': {'raw': raw_message}},
+                fields=self._fields('drafts.create')
+            ), 'drafts.create')
             
             return draft
         except Exception as e:
             print(f'Error creating draft: {e}')
             return None
     
+    def _build_raw_message(self, to, subject, body):
+        """Build the base64url-encoded MIME message expected by the Gmail API."""
+        message = MIMEMultipart()
+        message['to'] = to
+        message['subject'] = subject
+        
+        msg = MIMEText(body)
+        message.attach(msg)
+        
+        return base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
+    
     def auto_respond(self, email_info, template=None):
         """Generate and send an automatic response to an email."""
         # Skip auto-response if disabled in config
@@ -426,6 +1243,7 @@ class GmailAssistant:
         
         to = self.extract_email(email_info['sender'])
         subject = f"Re: {email_info['subject']}"
+        self.ensure_body(email_info)
         
         # Generate the response instead of using a template
         response_body = self.generate_email(
@@ -448,43 +1266,32 @@ class GmailAssistant:
     
     def extract_name(self, sender):
         """Extract name from email sender format: 'Name <email@example.com>'"""
-        match = re.match(r'(.*?)\s*<', sender)
-        if match:
-            return match.group(1).strip()
-        return 'there'  # Fallback if name can't be extracted
+        return sender_name(sender)
     
     def extract_email(self, sender):
         """Extract email from sender format: 'Name <email@example.com>'"""
-        match = re.search(r'<(.*?)>', sender)
-        if match:
-            return match.group(1)
-        return sender  # Return the whole string if it doesn't match the pattern
+        return sender_address(sender)
     
     def send_email(self, draft_id=None, to=None, subject=None, body=None):
         """Send an email, either from a draft or directly."""
         try:
             if draft_id:
                 # Send an existing draft
-                sent_message = self.service.users().drafts().send(
+                sent_message = self._execute(self.service.users().drafts().send(
                     userId=self.user_id,
-                    body={'id': draft_id}
-                ).execute()
+                    body={'id': draft_id},
+                    fields=self._fields('drafts.send')
+                ), 'drafts.send')
                 return sent_message
             elif to and subject and body:
                 # Create and send a new email
-                message = MIMEMultipart()
-                message['to'] = to
-                message['subject'] = subject
-                
-                msg = MIMEText(body)
-                message.attach(msg)
-                
-                raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
+                raw_message = self._build_raw_message(to, subject, body)
                 
-                sent_message = self.service.users().messages().send(
+                sent_message = self._execute(self.service.users().messages().send(
                     userId=self.user_id,
-                    body={'raw': raw_message}
-                ).execute()
+                    body={'raw': raw_message},
+                    fields=self._fields('messages.send')
+                ), 'messages.send')
                 
                 return sent_message
             else:
@@ -557,18 +1364,49 @@ class GmailAssistant:
             print(f"[ERROR] Failed to set up OpenAI: {e}")
             print("[DEBUG] Exception type:", type(e).__name__)
             return False
-    def generate_text(self, prompt, max_tokens=500, temperature=0.7):
-        """Generate text using OpenAI."""
+    def generate_text(self, prompt, max_tokens=500, temperature=0.7, timeout=None, use_cache=False, stream=False):
+        """Generate text using OpenAI.
+        
+        timeout, in seconds, bounds the whole API call: it is made once, without the
+        client's automatic retries, so it can never take longer. By default the
+        client's own timeout and retries apply.
+        With use_cache=True a text generated earlier for the same model, prompt,
+        temperature and max_tokens is returned from the response cache, and a newly
+        generated one is stored there.
+        
+        With stream=True an iterator of text deltas is returned instead, yielding
+        tokens as the model produces them (a cached text comes as a single delta).
+        It yields nothing if generation fails, and the text is only cached once the
+        stream completed.
+        """
+        cache_key = None
+        if use_cache and self.response_cache:
+            cache_key = ResponseCache.key(self.openai_model, prompt, temperature, max_tokens)
+            try:
+                cached_text = self.response_cache.get(cache_key)
+            except Exception as e:
+                print(f"[WARNING] Could not read the response cache: {e}")
+                cached_text = None
+            if cached_text is not None:
+                print(f"[DEBUG] Using cached response: {len(cached_text)} characters")
+                return iter([cached_text]) if stream else cached_text
+        
+        # Verify the client is available before making the request
+        if not hasattr(self, 'openai_client'):
+            print("[ERROR] OpenAI client is not initialized")
+            return iter(()) if stream else None
+        
+        print(f"[DEBUG] Generating text with {self.openai_model}, max_tokens={max_tokens}, temp={temperature}")
+        client = self.openai_client
+        if timeout is not None:
+            # Each retry would get the full timeout again, so a bounded call is not retried
+            client = client.with_options(timeout=timeout, max_retries=0)
+        if stream:
+            return self._stream_text(client, prompt, max_tokens, temperature, cache_key)
+        
         try:
-            # Verify the client is available before making the request
-            if not hasattr(self, 'openai_client'):
-                print("[ERROR] OpenAI client is not initialized")
-                return None
-                
-            print(f"[DEBUG] Generating text with {self.openai_model}, max_tokens={max_tokens}, temp={temperature}")
-            
             # Use the new OpenAI API
-            response = self.openai_client.chat.completions.create(
+            response = client.chat.completions.create(
                 model=self.openai_model,
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=max_tokens,
@@ -579,13 +1417,124 @@ class GmailAssistant:
             # Extract the generated text from the response
             generated_text = response.choices[0].message.content
             print(f"[DEBUG] Generation successful: {len(generated_text)} characters")
-            
-            return generated_text
         except Exception as e:
             print(f"[ERROR] Text generation failed: {type(e).__name__}: {e}")
             return None
-    def generate_email(self, topic=None, recipient_name=None, original_subject=None, original_content=None):
-        """Generate an email using OpenAI with context from original email."""
+        
+        self._cache_response(cache_key, generated_text)
+        return generated_text
+    
+    def _stream_text(self, client, prompt, max_tokens, temperature, cache_key):
+        """Yield the text deltas of a streamed completion, then cache the full text."""
+        chunks = []
+        started = time.time()
+        stream = None
+        try:
+            stream = client.chat.completions.create(
+                model=self.openai_model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens,
+                temperature=temperature,
+                n=1,
+                stream=True
+            )
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                if not chunks:
+                    print(f"[DEBUG] First token after {time.time() - started:.2f}s")
+                chunks.append(delta)
+                yield delta
+        except Exception as e:
+            print(f"[ERROR] Text generation failed: {type(e).__name__}: {e}")
+            return
+        finally:
+            # Also reached when the consumer stops early: release the connection
+            if stream is not None:
+                stream.close()
+        
+        generated_text = ''.join(chunks)
+        print(f"[DEBUG] Generation successful: {len(generated_text)} characters in {time.time() - started:.2f}s")
+        self._cache_response(cache_key, generated_text)
+    
+    def _cache_response(self, cache_key, generated_text):
+        """Store a generated text in the response cache if the request opted in."""
+        if not cache_key or not generated_text:
+            return
+        try:
+            self.response_cache.put(cache_key, generated_text)
+        except Exception as e:
+            print(f"[WARNING] Could not save the response to the cache: {e}")
+    
+    def generate_email(self, topic=None, recipient_name=None, original_subject=None, original_content=None,
+                       use_cache=False, stream=False):
+        """Generate an email using OpenAI with context from original email.
+        
+        use_cache is passed on to generate_text. With stream=True the raw text
+        deltas are returned as they arrive (see generate_text); pass their
+        concatenation to _finish_email for the cleaned-up email body.
+        """
+        prompt = self._build_email_prompt(recipient_name, original_subject, original_content)
+        if stream:
+            return self.generate_text(prompt, max_tokens=500, use_cache=use_cache, stream=True)
+        generated_text = self.generate_text(prompt, max_tokens=500, use_cache=use_cache)
+        return self._finish_email(generated_text)
+    
+    def generate_emails(self, emails, max_workers=None, timeout=None, use_cache=False):
+        """Generate replies to many emails concurrently.
+        
+        Up to max_workers (default reply_workers) OpenAI requests run at a time on
+        the shared client, each limited to timeout seconds (default reply_timeout)
+        and made once, without retries.
+        Returns one reply body per email, in the order of emails. An email whose
+        reply failed or timed out gets None instead of the generic fallback, so a
+        caller sending the replies leaves it unanswered (and unread) for the next
+        run. Bodies must already be loaded (see ensure_bodies); nothing is sent here.
+        use_cache is passed on to generate_text.
+        
+        If the caller is interrupted while waiting, queued requests are cancelled
+        and the ones in flight are abandoned, so no reply of this call can be sent
+        afterwards.
+        """
+        max_workers = max_workers or self.reply_workers
+        timeout = self.reply_timeout if timeout is None else timeout
+        prompts = [
+            self._build_email_prompt(sender_name(email['sender']), email['subject'], email.get('body'))
+            for email in emails
+        ]
+        if not prompts:
+            return []
+        
+        pool = ThreadPoolExecutor(max_workers=min(max_workers, len(prompts)), thread_name_prefix='openai-generate')
+        try:
+            futures = [pool.submit(self.generate_text, prompt, 500, 0.7, timeout, use_cache) for prompt in prompts]
+            replies = []
+            for future in futures:
+                generated_text = future.result()
+                replies.append(self._finish_email(generated_text) if generated_text else None)
+        finally:
+            # Returns at once: on an interruption nothing left in the pool is waited for
+            pool.shutdown(wait=False, cancel_futures=True)
+        return replies
+    
+    def send_reply(self, email_info, body):
+        """Send body as a reply to email_info and queue the email to be marked as read.
+        
+        Returns the sent message, or None if sending failed. The mark-as-read is
+        deferred; call flush_label_changes() once all replies are sent.
+        """
+        result = self.send_email(
+            to=sender_address(email_info['sender']),
+            subject=f"Re: {email_info['subject']}",
+            body=body
+        )
+        if result:
+            self.mark_as_read(email_info['id'], defer=True)
+        return result
+    
+    def _build_email_prompt(self, recipient_name=None, original_subject=None, original_content=None):
+        """Build the reply-generation prompt from the user's style prompt and the original email."""
         # Get custom prompt from config, or use default if not set
         user_prompt = self.config.get('user', {}).get('custom_prompt', 
             "Write a professional email response. Make sure proper formatting is done. DO NOT include the subject line in the email body as it will be added separately.")
@@ -606,7 +1555,10 @@ class GmailAssistant:
         else:
             prompt += ":\n\n"
         
-        generated_text = self.generate_text(prompt, max_tokens=500)
+        return prompt
+    
+    def _finish_email(self, generated_text):
+        """Turn raw generated text into the final email body, or a fallback if generation failed."""
         if not generated_text:
             return f"Thank you for your email. I've received your message and will get back to you with a more detailed response soon.\n\nBest regards,\n{self.get_user_name()}"
             
@@ -659,7 +1611,10 @@ class GmailAssistant:
         """Get the authenticated user's email address."""
         if not self.user_email:
             try:
-                profile = self.service.users().getProfile(userId='me').execute()
+                profile = self._execute(
+                    self.service.users().getProfile(userId='me', fields=self._fields('getProfile')),
+                    'getProfile'
+                )
                 self.user_email = profile.get('emailAddress', '')
                 return self.user_email
             except Exception as e:
@@ -685,18 +1640,31 @@ class GmailAssistant:
         
         return user_name
     
-    def mark_as_read(self, email_id):
-        """Mark an email as read by removing the UNREAD label."""
+    def mark_as_read(self, email_id, defer=False):
+        """Mark an email as read by removing the UNREAD label.
+        
+        With defer=True the change is queued and applied in bulk with batchModify
+        when the queue fills up or flush_label_changes() is called.
+        """
+        if defer:
+            self.label_queue.add([email_id], remove_labels=['UNREAD'])
+            return True
+        
         try:
-            self.service.users().messages().modify(
+            self._execute(self.service.users().messages().modify(
                 userId=self.user_id,
                 id=email_id,
-                body={'removeLabelIds': ['UNREAD']}
-            ).execute()
+                body={'removeLabelIds': ['UNREAD']},
+                fields=self._fields('messages.modify')
+            ), 'messages.modify')
             return True
         except Exception as e:
             print(f"Error marking email as read: {e}")
             return False
+    
+    def flush_label_changes(self):
+        """Apply all queued label changes; returns the IDs that could not be modified."""
+        return self.label_queue.flush()
             
     def display_logo(self):
         """Display the logo from the Logo.png file."""
@@ -723,7 +1691,30 @@ def main():
     print("---------------------\n")
     
     print("[DEBUG] Initializing Gmail Assistant...")
-    assistant = GmailAssistant()
+    assistant = GmailAssistant(
+        metadata_first=args.metadata_first,
+        fetch_mode=args.fetch_mode,
+        fetch_workers=args.workers,
+        classifier_engine=args.classifier,
+        model_path=args.model_path,
+        embedding_model_dir=args.embedding_model,
+        torch_threads=args.torch_threads
+    )
+    assistant.batch_size = args.batch_size
+    assistant.body_scan_chars = args.body_scan_chars
+    assistant.reply_workers = args.reply_workers
+    assistant.reply_timeout = args.reply_timeout
+    
+    if args.train_model and args.classifier == 'embedding':
+        if assistant.train_embedding_centroids() is not None:
+            print(f"[INFO] Trained embedding centroids from stored emails, saved to {assistant.centroids_path}")
+            assistant.reclassify_store()
+    elif args.train_model:
+        model = assistant.train_text_model()
+        print(f"[INFO] Trained text classifier on {int(model.class_counts.sum())} stored emails, saved to {assistant.model_path}")
+        if args.classifier == 'model':
+            # Stored categories came from the previous engine, so refile them with the new model
+            assistant.reclassify_store()
     
     # Display the logo
     logo_path = assistant.display_logo()
@@ -744,7 +1735,13 @@ def main():
     
     print("[DEBUG] Starting email sorting...")
     # Sort emails
-    sorted_emails = assistant.sort_emails()
+    if args.fetch_mode == 'async':
+        sorted_emails = asyncio.run(sort_emails_async(assistant, max_results=args.max_emails or None))
+    else:
+        sorted_emails = assistant.sort_emails(max_results=args.max_emails or None)
+    print(f"[DEBUG] Classification cache: {assistant.classification_cache.stats()}")
+    if assistant.sender_index:
+        print(f"[DEBUG] Emails filed by sender history (fast path): {assistant.sender_index.fast_path_count}")
     print("--- Sorted Emails ---")
     for category, emails in sorted_emails.items():
         print(f"\n{category.upper()} ({len(emails)})")
@@ -770,48 +1767,45 @@ def main():
         
         print(f"[DEBUG] Categories to auto-respond: {categories_to_respond if categories_to_respond != 'all' else 'ALL'}")
         
-        # Process emails in the selected categories
-        processed_emails = 0
+        # Collect the emails to answer in the selected categories
+        to_answer = []
         for category, emails in sorted_emails.items():
             if process_all or category in categories_to_respond:
                 print(f"[INFO] Processing emails in {CATEGORY_DISPLAY_NAMES.get(category, category)}")
-                
-                for idx, email in enumerate(emails):
-                    print(f"\n[DEBUG] Auto-responding to email {idx+1}/{len(emails)}: {email['subject']}")
-                    
-                    # Get recipient information
-                    sender_email = assistant.extract_email(email['sender'])
-                    sender_name = assistant.extract_name(email['sender'])
-                    
-                    # Wait specified time if needed (converted to seconds)
-                    if waiting_time > 0:
-                        print(f"[INFO] Waiting {waiting_time} minutes before sending response...")
-                        time.sleep(waiting_time * 60)
-                    
-                    # Generate response
-                    print(f"[DEBUG] Generating response to {sender_name} ({sender_email}) using OpenAI...")
-                    response_body = assistant.generate_email(
-                        recipient_name=sender_name,
-                        original_subject=email['subject'],
-                        original_content=email['body']
-                    )
-                    
-                    # Send response
-                    print("[DEBUG] Response generated successfully.")
-                    print(f"[DEBUG] Sending email to {sender_email}...")
-                    reply_subject = f"Re: {email['subject']}"
-                    response = assistant.send_email(
-                        to=sender_email,
-                        subject=reply_subject,
-                        body=response_body
-                    )
-                    
-                    # Mark as read after processing
-                    print(f"[DEBUG] Marking email {email['id']} as read...")
-                    assistant.mark_as_read(email['id'])
-                    print(f"✓ Response sent to {sender_email} and email marked as read")
-                    processed_emails += 1
+                to_answer.extend(emails)
+        assistant.ensure_bodies(to_answer)
+        
+        # Generate all responses concurrently; nothing is sent until they are done
+        print(f"[DEBUG] Generating {len(to_answer)} responses using OpenAI ({assistant.reply_workers} at a time)...")
+        replies = assistant.generate_emails(to_answer, use_cache=True)
+        
+        # Wait specified time if needed (converted to seconds)
+        if to_answer and waiting_time > 0:
+            print(f"[INFO] Waiting {waiting_time} minutes before sending responses...")
+            time.sleep(waiting_time * 60)
+        
+        # Send the generated responses one by one
+        processed_emails = 0
+        for idx, (email, response_body) in enumerate(zip(to_answer, replies)):
+            print(f"\n[DEBUG] Auto-responding to email {idx+1}/{len(to_answer)}: {email['subject']}")
+            sender_email = assistant.extract_email(email['sender'])
+            if response_body is None:
+                print(f"[WARNING] No response generated for {sender_email}, leaving the email unread")
+                continue
+            
+            print(f"[DEBUG] Sending email to {sender_email}...")
+            # Queues the email to be marked as read once all responses are sent
+            if assistant.send_reply(email, response_body):
+                print(f"✓ Response sent to {sender_email}")
+                processed_emails += 1
+        
+        print("[DEBUG] Marking processed emails as read...")
+        failed_ids = assistant.flush_label_changes()
+        if failed_ids:
+            print(f"[WARNING] Could not mark {len(failed_ids)} emails as read: {', '.join(failed_ids)}")
         
+        if assistant.response_cache:
+            print(f"[DEBUG] Response cache: {assistant.response_cache.stats()}")
         print(f"[INFO] Auto-responded to {processed_emails} emails from {len(categories_to_respond) if categories_to_respond != 'all' else 'all'} categories")
     else:
         print("[INFO] Auto-response is disabled in config")
@@ -0,0 +1,322 @@
+"""Asyncio client for the Gmail Assistant's fetch/classify/reply pipeline."""
+import asyncio
+
+import httpx
+import openai
+from google.auth.transport.requests import Request
+
+from constants import GMAIL_PAGE_SIZE, METADATA_HEADERS
+from gmail_quota import NON_IDEMPOTENT_METHODS
+from label_queue import BATCH_MODIFY_LIMIT
+from response_cache import ResponseCache
+
+GMAIL_API_URL = 'https://gmail.googleapis.com/gmail/v1/users'
+
+# Transport errors raised before the request reached Gmail, so even a send may be retried
+UNSENT_REQUEST_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class AsyncGmailAssistant:
+    """Async counterpart of the network operations of a GmailAssistant.
+
+    Gmail REST calls go through one pooled httpx.AsyncClient under the assistant's
+    shared quota limiter, and OpenAI calls through openai.AsyncOpenAI, so many
+    messages can be fetched and classified concurrently on one event loop. Credentials,
+    configuration, the local store and the parsing/classification logic come from the
+    wrapped GmailAssistant, and every method returns the same shape as its synchronous
+    counterpart. The CLI sorts with it under --fetch-mode async (see sort_emails_async).
+    """
+
+    def __init__(self, assistant, max_connections=20, openai_api_key=None):
+        self.assistant = assistant
+        self.user_id = assistant.user_id
+        self.max_connections = max_connections
+        self.fetch_errors = {}
+        self.http = httpx.AsyncClient(
+            base_url=GMAIL_API_URL,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=30.0
+        )
+
+        # Reuse the key of the synchronous OpenAI client unless one is given explicitly
+        if openai_api_key is None and hasattr(assistant, 'openai_client'):
+            openai_api_key = assistant.openai_client.api_key
+        self.openai_client = openai.AsyncOpenAI(api_key=openai_api_key) if openai_api_key else None
+        self._refresh_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        """Close the pooled HTTP connections."""
+        await self.http.aclose()
+        if self.openai_client is not None:
+            await self.openai_client.close()
+
+    async def _auth_headers(self):
+        """Return the Authorization header, refreshing the access token if it expired."""
+        creds = self.assistant.credentials
+        if not creds.valid:
+            async with self._refresh_lock:
+                if not creds.valid:
+                    # google-auth refreshes synchronously, so keep it off the event loop
+                    await asyncio.to_thread(creds.refresh, Request())
+        return {'Authorization': f'Bearer {creds.token}'}
+
+    async def _request(self, http_method, path, method, call_site=None, **kwargs):
+        """Send one Gmail API request under the shared quota limiter and return the decoded JSON.
+
+        `method` names the Gmail method for quota accounting and retry policy;
+        `call_site` selects the field mask and defaults to `method`. Dropped
+        connections and timeouts are retried like server errors, except for
+        non-idempotent calls that may already have reached Gmail.
+        """
+        limiter = self.assistant.rate_limiter
+        params = kwargs.pop('params', {})
+        fields = self.assistant._fields(call_site or method)
+        if fields:
+            params['fields'] = fields
+
+        for attempt in range(limiter.max_retries + 1):
+            await limiter.acquire_async(method)
+            try:
+                response = await self.http.request(
+                    http_method,
+                    f'/{self.user_id}/{path}',
+                    params=params,
+                    headers=await self._auth_headers(),
+                    **kwargs
+                )
+            except httpx.TransportError as e:
+                retryable = method not in NON_IDEMPOTENT_METHODS or isinstance(e, UNSENT_REQUEST_ERRORS)
+                if attempt == limiter.max_retries or not retryable:
+                    raise
+                delay = limiter.retry_delay(attempt)
+                limiter.retries += 1
+                print(f"[WARNING] Gmail {method} failed with {type(e).__name__}, retrying in {delay:.1f}s "
+                      f"(attempt {attempt + 1}/{limiter.max_retries})")
+                await asyncio.sleep(delay)
+                continue
+            if response.is_success:
+                return response.json() if response.content else {}
+            if attempt == limiter.max_retries or not limiter.should_retry(method, response.status_code, response.text):
+                response.raise_for_status()
+            await asyncio.sleep(limiter.backoff(method, attempt, response.status_code, response.headers.get('retry-after')))
+
+    async def list_unread_ids(self, max_results=10, page_size=GMAIL_PAGE_SIZE):
+        """Get the IDs of unread emails, newest first, following nextPageToken up to max_results."""
+        message_ids = []
+        page_token = None
+        while max_results is None or len(message_ids) < max_results:
+            request_size = min(page_size, 500)
+            if max_results is not None:
+                request_size = min(request_size, max_results - len(message_ids))
+            params = {'q': 'is:unread', 'maxResults': request_size}
+            if page_token:
+                params['pageToken'] = page_token
+            response = await self._request('GET', 'messages', 'messages.list', params=params)
+
+            message_ids.extend(msg['id'] for msg in response.get('messages', []))
+            page_token = response.get('nextPageToken')
+            if not page_token or not response.get('messages'):
+                break
+        return message_ids if max_results is None else message_ids[:max_results]
+
+    async def get_message(self, message_id, format='full'):
+        """Fetch one message."""
+        if format == 'metadata':
+            params = {'format': 'metadata', 'metadataHeaders': METADATA_HEADERS}
+            return await self._request('GET', f'messages/{message_id}', 'messages.get',
+                                       call_site='messages.get.metadata', params=params)
+        return await self._request('GET', f'messages/{message_id}', 'messages.get', params={'format': format})
+
+    async def get_messages(self, message_ids, format='full'):
+        """Fetch messages concurrently, keeping the order of message_ids.
+
+        Failed messages are left out and added to self.fetch_errors, which keeps the
+        errors of earlier calls until the next sort_emails call.
+        """
+        semaphore = asyncio.Semaphore(self.max_connections)
+
+        async def fetch(message_id):
+            async with semaphore:
+                return await self.get_message(message_id, format)
+
+        responses = await asyncio.gather(*(fetch(message_id) for message_id in message_ids), return_exceptions=True)
+
+        messages = []
+        for message_id, response in zip(message_ids, responses):
+            if isinstance(response, Exception):
+                self.fetch_errors[message_id] = response
+                print(f"[WARNING] Failed to fetch message {message_id}: {response}")
+            else:
+                self.fetch_errors.pop(message_id, None)
+                messages.append(response)
+        return messages
+
+    async def get_unread_emails(self, max_results=10):
+        """Get a list of unread emails."""
+        try:
+            return await self.get_messages(await self.list_unread_ids(max_results=max_results))
+        except Exception as e:
+            print(f'Error retrieving emails: {e}')
+            return []
+
+    async def load_emails(self, message_ids):
+        """Return (email_info, category) pairs for message_ids, serving stored emails from the local store.
+
+        SQLite access and classification (which may run embedding inference) are
+        blocking, so they run in worker threads and other mailboxes keep going meanwhile.
+        """
+        assistant = self.assistant
+        cached = await asyncio.to_thread(assistant.store.get_many, message_ids) if assistant.store else {}
+        missing = [message_id for message_id in message_ids if message_id not in cached]
+
+        message_format = 'metadata' if assistant.metadata_first else 'full'
+        messages = await self.get_messages(missing, format=message_format) if missing else []
+        loaded = await asyncio.to_thread(assistant._process_messages, messages)
+        return await asyncio.to_thread(assistant._merge_loaded, message_ids, cached, loaded)
+
+    async def sort_emails(self, max_results=20):
+        """Sort emails into categories, in the same shape as GmailAssistant.sort_emails."""
+        self.fetch_errors = {}
+        categories = self.assistant._empty_categories()
+        try:
+            message_ids = await self.list_unread_ids(max_results=max_results)
+        except Exception as e:
+            print(f'Error retrieving emails: {e}')
+            return categories
+
+        for email_info, category in await self.load_emails(message_ids):
+            categories[category].append(email_info)
+        return categories
+
+    async def ensure_body(self, email_info):
+        """Download the body of an email listed in metadata-first mode, if not loaded yet."""
+        if email_info.get('body') is not None:
+            return email_info['body']
+        try:
+            message = await self.get_message(email_info['id'])
+            # MIME decoding and HTML-to-text conversion are CPU-bound
+            email_info['body'] = (await asyncio.to_thread(self.assistant.extract_email_info, message))['body']
+        except Exception as e:
+            print(f"Error loading email body: {e}")
+            return ''
+        if self.assistant.store:
+            await asyncio.to_thread(self.assistant.store.update_body, email_info['id'], email_info['body'])
+        return email_info['body']
+
+    async def send_email(self, to, subject, body):
+        """Send an email directly."""
+        try:
+            raw_message = self.assistant._build_raw_message(to, subject, body)
+            return await self._request('POST', 'messages/send', 'messages.send', json={'raw': raw_message})
+        except Exception as e:
+            print(f'Error sending email: {e}')
+            return None
+
+    async def mark_as_read(self, email_id):
+        """Mark an email as read by removing the UNREAD label."""
+        try:
+            await self._request(
+                'POST',
+                f'messages/{email_id}/modify',
+                'messages.modify',
+                json={'removeLabelIds': ['UNREAD']}
+            )
+            return True
+        except Exception as e:
+            print(f"Error marking email as read: {e}")
+            return False
+
+    async def batch_modify(self, message_ids, add_labels=(), remove_labels=()):
+        """Apply one label change to many messages with batchModify; returns the IDs that could not be modified.
+
+        Like LabelChangeQueue, a chunk whose batchModify call fails is retried one
+        message at a time with modify.
+        """
+        body = {}
+        if add_labels:
+            body['addLabelIds'] = list(add_labels)
+        if remove_labels:
+            body['removeLabelIds'] = list(remove_labels)
+
+        failed = []
+        message_ids = list(message_ids)
+        for start in range(0, len(message_ids), BATCH_MODIFY_LIMIT):
+            chunk = message_ids[start:start + BATCH_MODIFY_LIMIT]
+            try:
+                await self._request('POST', 'messages/batchModify', 'messages.batchModify', json=dict(body, ids=chunk))
+            except Exception as e:
+                print(f"[WARNING] batchModify of {len(chunk)} emails failed, modifying one by one: {e}")
+                results = await asyncio.gather(
+                    *(self._request('POST', f'messages/{message_id}/modify', 'messages.modify', json=body)
+                      for message_id in chunk),
+                    return_exceptions=True
+                )
+                failed.extend(message_id for message_id, result in zip(chunk, results) if isinstance(result, Exception))
+        return failed
+
+    async def mark_many_as_read(self, email_ids):
+        """Mark emails as read in bulk; returns the IDs that could not be modified."""
+        return await self.batch_modify(email_ids, remove_labels=['UNREAD'])
+
+    async def get_user_email(self):
+        """Get the authenticated user's email address."""
+        if not self.assistant.user_email:
+            try:
+                profile = await self._request('GET', 'profile', 'getProfile')
+                self.assistant.user_email = profile.get('emailAddress', '')
+            except Exception as e:
+                print(f"Error getting user email: {e}")
+                return ''
+        return self.assistant.user_email
+
+    async def generate_text(self, prompt, max_tokens=500, temperature=0.7, use_cache=False):
+        """Generate text using OpenAI; use_cache works as in GmailAssistant.generate_text."""
+        cache = self.assistant.response_cache if use_cache else None
+        cache_key = None
+        if cache:
+            cache_key = ResponseCache.key(self.assistant.openai_model, prompt, temperature, max_tokens)
+            cached_text = await asyncio.to_thread(cache.get, cache_key)
+            if cached_text is not None:
+                return cached_text
+        if self.openai_client is None:
+            print("[ERROR] OpenAI client is not initialized")
+            return None
+        try:
+            response = await self.openai_client.chat.completions.create(
+                model=self.assistant.openai_model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens,
+                temperature=temperature,
+                n=1
+            )
+            generated_text = response.choices[0].message.content
+        except Exception as e:
+            print(f"[ERROR] Text generation failed: {type(e).__name__}: {e}")
+            return None
+        if cache_key and generated_text:
+            await asyncio.to_thread(cache.put, cache_key, generated_text)
+        return generated_text
+
+    async def generate_email(self, topic=None, recipient_name=None, original_subject=None, original_content=None,
+                             use_cache=False):
+        """Generate an email using OpenAI with context from original email."""
+        prompt = self.assistant._build_email_prompt(recipient_name, original_subject, original_content)
+        generated_text = await self.generate_text(prompt, max_tokens=500, use_cache=use_cache)
+        return self.assistant._finish_email(generated_text)
+
+
+async def sort_emails_async(assistant, max_results=20):
+    """Sort the unread emails of an authenticated GmailAssistant with a temporary async client.
+
+    Fetch errors are copied to assistant.fetch_errors, as after assistant.sort_emails.
+    """
+    async with AsyncGmailAssistant(assistant) as client:
+        categories = await client.sort_emails(max_results=max_results)
+    assistant.fetch_errors = client.fetch_errors
+    return categories
@@ -0,0 +1,83 @@
+"""Compare the memory of EmailInfo records with the plain dicts they replace, on a 50k-email corpus.
+
+Run from the repository root:
+
+    python benchmarks/email_info_memory_benchmark.py
+"""
+import os
+import sys
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from email_info import EmailInfo  # noqa: E402
+
+CORPUS_SIZE = 50000
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def corpus_fields():
+    """Yield the field values of a synthetic corpus, metadata-first (no bodies loaded)."""
+    for i in range(CORPUS_SIZE):
+        yield (
+            f'18c{i:013x}',
+            f'Weekly report #{i} for project {i % 40}',
+            f'Sender {i % 500} <sender{i % 500}@example{i % 30}.com>',
+            None,
+            f'Here is the summary of activity for week {i}, including highlights and open items',
+            START + timedelta(minutes=i)
+        )
+
+
+def build_dicts(fields):
+    return [
+        {'id': id, 'subject': subject, 'sender': sender, 'body': body, 'snippet': snippet, 'date': date}
+        for id, subject, sender, body, snippet, date in fields
+    ]
+
+
+def build_records(fields):
+    return [EmailInfo(*values) for values in fields]
+
+
+def display_copies(emails):
+    """What display_emails used to allocate per rerun: a category copy and a sanitized copy of every email."""
+    copies = []
+    for email in emails:
+        email_copy = email.copy()
+        email_copy['category'] = 'main_inbox'
+        safe_email = email_copy.copy()
+        safe_email['subject'] = email['subject'].replace('<', '&lt;')
+        copies.append(safe_email)
+    return copies
+
+
+def measure(build, *args):
+    """Return (result, bytes allocated and still alive) for build(*args)."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build(*args)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def main():
+    # Field values are shared by both representations, so only the containers are compared
+    fields = list(corpus_fields())
+
+    dicts, dict_bytes = measure(build_dicts, fields)
+    records, record_bytes = measure(build_records, fields)
+    _, copy_bytes = measure(display_copies, dicts)
+
+    print(f"{CORPUS_SIZE} emails (container overhead, field values shared)")
+    print(f"  dicts:          {dict_bytes / 2 ** 20:7.2f} MiB  ({dict_bytes / CORPUS_SIZE:6.0f} B/email)")
+    print(f"  EmailInfo:      {record_bytes / 2 ** 20:7.2f} MiB  ({record_bytes / CORPUS_SIZE:6.0f} B/email)")
+    print(f"  saved:          {(dict_bytes - record_bytes) / 2 ** 20:7.2f} MiB  "
+          f"({1 - record_bytes / dict_bytes:.0%})")
+    print(f"  dict copies per display_emails rerun (removed): {copy_bytes / 2 ** 20:.2f} MiB")
+
+
+if __name__ == '__main__':
+    main()
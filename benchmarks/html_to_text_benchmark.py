@@ -0,0 +1,56 @@
+"""Benchmark html_to_text on synthetic marketing emails of increasing size.
+
+Run from the repository root:
+
+    python benchmarks/html_to_text_benchmark.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from html_text import html_to_text  # noqa: E402
+
+HEAD = """<!DOCTYPE html><html><head><meta charset="utf-8"><title>Weekly deals</title>
+<style>body{margin:0;padding:0}.btn{background:#ff6600;color:#fff;border-radius:4px}
+@media (max-width:600px){.col{width:100%!important}}</style>
+<script>window.dataLayer=window.dataLayer||[];function gtag(){dataLayer.push(arguments);}</script>
+</head><body style="margin:0"><center><table width="600" cellpadding="0" cellspacing="0" border="0">"""
+
+# One product block as typically produced by email marketing tools: nested layout tables and inline styles
+BLOCK = """<tr><td class="col" style="padding:12px 24px;font-family:Helvetica,Arial,sans-serif">
+<table width="100%"><tr><td><img src="https://example.com/p/{i}.png" width="120" alt="Product {i}"></td>
+<td style="font-size:14px;line-height:20px;color:#333333"><h2 style="margin:0">Product {i} &mdash; now 30% off</h2>
+<p>Limited&nbsp;time offer on item {i}. Free shipping on orders over &pound;50, returns within 30 days.</p>
+<a class="btn" href="https://example.com/buy/{i}?utm_source=newsletter&amp;utm_medium=email">Shop now</a>
+</td></tr></table></td></tr>"""
+
+TAIL = """</table><p style="font-size:11px;color:#999">You are receiving this email because you subscribed.
+<a href="https://example.com/unsubscribe">Unsubscribe</a></p></center></body></html>"""
+
+
+def marketing_email(blocks):
+    return HEAD + ''.join(BLOCK.format(i=i) for i in range(blocks)) + TAIL
+
+
+def main():
+    print(f"{'html size':>10} {'text size':>10} {'time/email':>12} {'throughput':>12}")
+    for blocks in (10, 100, 500, 2000):
+        html = marketing_email(blocks)
+        # Measure the full document: the default input cap would stop the large ones early
+        text = html_to_text(html, max_chars=len(html), max_input_chars=len(html))
+        runs = max(3, 2000 // blocks)
+        seconds = min(timeit.repeat(
+            lambda: html_to_text(html, max_chars=len(html), max_input_chars=len(html)), number=runs, repeat=3
+        )) / runs
+        print(f"{len(html) / 1024:>8.0f}KB {len(text) / 1024:>8.0f}KB {seconds * 1000:>10.2f}ms "
+              f"{len(html) / seconds / 2 ** 20:>9.1f}MB/s")
+
+    html = marketing_email(2000)
+    seconds = min(timeit.repeat(lambda: html_to_text(html), number=5, repeat=3)) / 5
+    print(f"with default caps, {len(html) / 1024:.0f}KB email: {seconds * 1000:.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
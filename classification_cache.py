@@ -0,0 +1,69 @@
+"""Bounded in-memory cache of email classification results."""
+import threading
+from collections import OrderedDict
+
+from constants import CLASSIFICATION_CACHE_SIZE
+
+
+class ClassificationCache:
+    """LRU cache of (category, confidence) results keyed by (message_id, classifier version).
+
+    The classifier version identifies the keyword rules and model that produced a
+    result (see GmailAssistant.classification_version). As soon as a lookup is made
+    with a new version every older entry is dropped, so changing the rules or
+    retraining the model can never serve a stale classification.
+    """
+
+    def __init__(self, max_size=CLASSIFICATION_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, message_id, version):
+        """Return the cached (category, confidence) for a message, or None."""
+        with self._lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+            key = (message_id, version)
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, message_id, version, result):
+        """Cache the (category, confidence) of a message, evicting the least recently used entry if full."""
+        with self._lock:
+            if version != self.version:
+                # Computed under rules or a model that have since changed
+                return
+            key = (message_id, version)
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        """Drop every cached result."""
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self):
+        """Return the hit/miss counters and current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'size': len(self.entries)
+            }
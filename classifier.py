@@ -0,0 +1,152 @@
+"""Keyword rule matching for email classification."""
+import hashlib
+import json
+import re
+import threading
+
+import numpy as np
+
+# Endings accepted after a keyword when matching whole words, so 'invoice' also matches
+# 'invoices' and 'meeting' matches 'meetings'. Keywords this short or shorter only match
+# exactly ('hi' must not match 'his').
+INFLECTION_SUFFIXES = ('s', 'es', 'd', 'ed', 'ing')
+MIN_INFLECTED_KEYWORD_LENGTH = 3
+
+
+def ruleset_fingerprint(rules):
+    """Return a stable hash of a category -> keywords rule set."""
+    canonical = json.dumps([[category, list(keywords)] for category, keywords in rules.items()])
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+class KeywordMatcher:
+    """Multi-keyword matcher compiled from category keyword rules.
+
+    All keywords are compiled into one alternation regex wrapped in a lookahead, so a
+    single pass over the text reports every keyword occurrence, including keywords
+    that overlap (e.g. 'question' inside 'quick question'). The regex reports one
+    keyword per position, the longest; shorter keywords starting at the same position
+    ('team' in 'teams' next to 'teams') are then checked against their own patterns,
+    which only runs for keywords that are prefixes of another. With word_boundaries=True
+    keywords must start at a word boundary, so 'hi' no longer matches inside 'this',
+    and end at one or after a common inflection ('invoices', 'errors', 'received'
+    for 'invoice', 'error', 'receive'; see INFLECTION_SUFFIXES).
+    """
+
+    def __init__(self, rules, word_boundaries=True):
+        self.rules = {category: tuple(keywords) for category, keywords in rules.items()}
+        self.word_boundaries = word_boundaries
+        # Matching options change results as much as the rules do
+        self.fingerprint = ruleset_fingerprint(self.rules) + ('-words' if word_boundaries else '')
+
+        # A keyword may belong to several categories ('update' is both main_inbox and basic_alerts)
+        self.keyword_categories = {}
+        for category, keywords in self.rules.items():
+            for keyword in keywords:
+                self.keyword_categories.setdefault(keyword.lower(), []).append(category)
+        self.category_order = {category: index for index, category in enumerate(self.rules)}
+
+        # Longest keywords first so the alternation prefers 'thank you' over a shorter prefix
+        keywords = sorted(self.keyword_categories, key=len, reverse=True)
+        if word_boundaries:
+            inflected = '|'.join(re.escape(k) for k in keywords if len(k) >= MIN_INFLECTED_KEYWORD_LENGTH)
+            exact = '|'.join(re.escape(k) for k in keywords if len(k) < MIN_INFLECTED_KEYWORD_LENGTH)
+            suffixes = '|'.join(INFLECTION_SUFFIXES)
+            # Group 1 holds an inflectable keyword, group 2 a short keyword matched exactly
+            alternation = rf'(?<!\w)(?:({inflected or "(?!)"})(?:{suffixes})?|({exact or "(?!)"}))(?!\w)'
+        else:
+            alternation = '(' + '|'.join(re.escape(keyword) for keyword in keywords) + ')'
+        self.pattern = re.compile(rf'(?={alternation})') if keywords else None
+
+        # keyword -> [(shorter keyword it starts with, pattern matching that keyword on its own)]
+        self.prefix_keywords = {}
+        for keyword in keywords:
+            for prefix in keywords:
+                if len(prefix) < len(keyword) and keyword.startswith(prefix):
+                    self.prefix_keywords.setdefault(keyword, []).append((prefix, self._keyword_pattern(prefix)))
+
+        # Keyword x category membership matrix used to score many texts at once
+        self.category_names = list(self.rules)
+        self.keyword_index = {keyword: index for index, keyword in enumerate(keywords)}
+        self.membership = np.zeros((len(keywords), len(self.category_names)), dtype=np.float32)
+        for keyword, categories in self.keyword_categories.items():
+            for category in categories:
+                self.membership[self.keyword_index[keyword], self.category_order[category]] = 1.0
+
+    def _keyword_pattern(self, keyword):
+        """Compile the pattern of a single keyword, matched at a position where a keyword may start."""
+        if not self.word_boundaries:
+            return re.compile(re.escape(keyword))
+        if len(keyword) >= MIN_INFLECTED_KEYWORD_LENGTH:
+            return re.compile(rf'{re.escape(keyword)}(?:{"|".join(INFLECTION_SUFFIXES)})?(?!\w)')
+        return re.compile(rf'{re.escape(keyword)}(?!\w)')
+
+    def _iter_keywords(self, text):
+        """Yield every keyword occurrence in lowercased text, including keywords starting at the same position."""
+        for match in self.pattern.finditer(text):
+            keyword = match.group(1) or match.group(2)
+            yield keyword
+            for prefix, pattern in self.prefix_keywords.get(keyword, ()):
+                if pattern.match(text, match.start()):
+                    yield prefix
+
+    def find(self, text):
+        """Return {category: [keywords found]} for every category hit in text, in rule order."""
+        hits = {}
+        if self.pattern is None or not text:
+            return hits
+        for keyword in self._iter_keywords(text.lower()):
+            for category in self.keyword_categories[keyword]:
+                hits.setdefault(category, []).append(keyword)
+        return dict(sorted(hits.items(), key=lambda item: self.category_order[item[0]]))
+
+    def categories(self, text):
+        """Return the categories whose keywords occur in text, in rule order."""
+        return list(self.find(text))
+
+    def score_batch(self, texts, distinct=False):
+        """Return an (n_texts, n_categories) array of keyword hit counts per category.
+
+        Each text is scanned once to build a sparse text x keyword matrix (as row and
+        column index arrays); the category scores are then a single matrix product
+        with the keyword x category membership matrix. With distinct=True a keyword
+        counts once per text however often it occurs.
+        """
+        rows = []
+        cols = []
+        if self.pattern is not None:
+            keyword_index = self.keyword_index
+            for row, text in enumerate(texts):
+                if not text:
+                    continue
+                for keyword in self._iter_keywords(text.lower()):
+                    rows.append(row)
+                    cols.append(keyword_index[keyword])
+
+        hits = np.zeros((len(texts), len(self.keyword_index)), dtype=np.float32)
+        np.add.at(hits, (np.asarray(rows, dtype=np.intp), np.asarray(cols, dtype=np.intp)), 1.0)
+        if distinct:
+            np.minimum(hits, 1.0, out=hits)
+        return hits @ self.membership
+
+
+_matchers = {}
+_matchers_lock = threading.Lock()
+
+
+def get_keyword_matcher(rules, word_boundaries=True):
+    """Return a compiled matcher for rules, shared by every caller using the same rule set.
+
+    Matchers are cached by rule contents, so a matcher is only rebuilt when the
+    rules actually change.
+    """
+    # Keyed by the rule contents (cheaper to hash than the fingerprint), so edited rules get a new matcher
+    key = (tuple((category, tuple(keywords)) for category, keywords in rules.items()), word_boundaries)
+    matcher = _matchers.get(key)
+    if matcher is None:
+        with _matchers_lock:
+            matcher = _matchers.get(key)
+            if matcher is None:
+                matcher = KeywordMatcher(rules, word_boundaries=word_boundaries)
+                _matchers[key] = matcher
+    return matcher
@@ -34,6 +34,20 @@ CATEGORY_DISPLAY_NAMES = {
     'rules_in_training': 'Training'
 }
 
+# Subject keywords that file an email under each category, in priority order
+CATEGORY_KEYWORDS = {
+    'priority_inbox': ['follow up', 'question', 'need', 'asap', 'approve', 'feedback', 'waiting on', 'deadline', 'important'],
+    'main_inbox': ['update', 'information', 'hello', 'hi', 'greetings', 'thanks', 'thank you'],
+    'urgent_alerts': ['warning', 'critical', 'error', 'alert', 'urgent', 'failed', 'down', 'issue', 'emergency', 'breach'],
+    'basic_alerts': ['report', 'summary', 'update', 'daily stats', 'weekly stats', 'monthly stats', 'notification'],
+    'fyi_cc': ['fyi', 'for your information', 'just letting you know', 'for your awareness', 'in case you missed'],
+    'billing_finance': ['invoice', 'payment', 'receipt', 'subscription', 'charge', 'statement', 'bill', 'transaction', 'finance'],
+    'scheduling_calendars': ['invite', 'meeting', 'calendar', 'schedule', 'appointment', 'call', 'booking', 'zoom', 'google meet', 'teams'],
+    'marketing_promotions': ['webinar', 'deal', 'promo', 'save', 'limited time', 'offer', 'discount', 'subscribe', 'newsletter'],
+    'team_internal': ['team', 'internal', 'quick question', 'can you check', 'office'],
+    'projects_clients': ['project', 'client', 'proposal', 'deliverable', 'scope', 'contract']
+}
+
 # Auto-response categories options
 AUTO_RESPONSE_CATEGORIES = {
     'Priority Inbox Only': ['priority_inbox'],
@@ -51,3 +65,106 @@ AUTO_RESPONSE_WAITING_TIMES = {
     'Delayed': 15,
     'Custom': 0  # To be configured per user preference
 }
+
+# Maximum number of sub-requests sent in one Gmail batch request
+# (Gmail accepts up to 100 but recommends batches of 50 or fewer)
+GMAIL_BATCH_SIZE = 50
+
+# Worker threads used to download messages in concurrent fetch mode
+FETCH_WORKERS = 4
+
+# Number of message IDs requested per messages().list page (Gmail allows up to 500)
+GMAIL_PAGE_SIZE = 100
+
+# Headers requested when listing emails in metadata-first mode
+METADATA_HEADERS = ['Subject', 'From', 'Date']
+
+# Partial-response field masks sent as the `fields` parameter of each Gmail API call site.
+# Each mask lists only what the assistant reads from the response; set an entry to None
+# (or override it on GmailAssistant.field_masks) to request the full resource.
+GMAIL_FIELD_MASKS = {
+    'messages.list': 'messages/id,nextPageToken',
+    'messages.get': 'id,threadId,labelIds,historyId,internalDate,payload(mimeType,filename,headers,body,parts)',
+    'messages.get.metadata': 'id,threadId,labelIds,historyId,internalDate,snippet,payload/headers',
+    'messages.send': 'id,threadId,labelIds',
+    'messages.modify': 'id',
+    'drafts.create': 'id,message(id,threadId)',
+    'drafts.send': 'id,threadId,labelIds',
+    'getProfile': 'emailAddress,historyId',
+    'history.list': ('history(messagesAdded/message(id,labelIds),messagesDeleted/message/id,'
+                     'labelsAdded/message(id,labelIds),labelsRemoved/message(id,labelIds)),'
+                     'historyId,nextPageToken'),
+}
+
+# Gmail API quota units charged per method
+# (see https://developers.google.com/gmail/api/reference/quota)
+GMAIL_QUOTA_UNITS = {
+    'messages.list': 5,
+    'messages.get': 5,
+    'messages.send': 100,
+    'messages.modify': 5,
+    'messages.batchModify': 50,
+    'drafts.create': 10,
+    'drafts.send': 100,
+    'getProfile': 1,
+    'history.list': 2,
+}
+
+# Gmail per-user limit of 15,000 quota units per minute, expressed per second
+GMAIL_QUOTA_UNITS_PER_SECOND = 250
+
+# Retry settings for throttled or failed Gmail API calls
+GMAIL_MAX_RETRIES = 5
+GMAIL_BACKOFF_BASE = 1.0  # seconds
+GMAIL_BACKOFF_MAX = 32.0  # seconds
+
+# Online learning from user actions in the Streamlit UI (see GmailAssistant.learn_from_action).
+# The learned model only second-guesses the keyword rules once it has seen enough labeled
+# emails, spread over enough categories, and is confident in its own prediction. A category
+# counts only with enough examples of its own, and only such a category can overrule the rules
+# (a model that has only seen one category is certain of it for any text).
+ONLINE_LEARNING_MIN_EXAMPLES = 20
+ONLINE_LEARNING_MIN_CLASSES = 3
+ONLINE_LEARNING_MIN_CLASS_EXAMPLES = 5
+ONLINE_LEARNING_MIN_CONFIDENCE = 0.8
+MODEL_SAVE_INTERVAL = 30.0  # seconds between saves of the learned model
+
+# Maximum number of classification results kept in memory (see ClassificationCache)
+CLASSIFICATION_CACHE_SIZE = 10000
+
+# A sender (or domain) whose emails went to one category this consistently is filed
+# there directly, without classification (see SenderIndex)
+SENDER_FAST_PATH_MIN_EMAILS = 5
+SENDER_FAST_PATH_MIN_SHARE = 0.95
+
+# Keyword rules also scan the start of the body, capped so huge bodies cost no more than this
+BODY_SCAN_CHARS = 4000
+
+# Confidence of a category matched by a subject keyword, and of each distinct keyword of the
+# category found in the body. They combine as 1 - (1 - subject) * (1 - body) ** keywords.
+# Body keywords like 'need' or 'feedback' occur in almost any email, so one or two of them
+# (0.3, 0.51) stay below the 0.6 needed to file an email and only strengthen a subject match;
+# three distinct keywords of one category (0.66, e.g. 'critical', 'error' and 'down') file it.
+SUBJECT_MATCH_CONFIDENCE = 0.8
+BODY_MATCH_CONFIDENCE = 0.3
+
+# Largest email body decoded from a message, in bytes; longer bodies are truncated
+MAX_DECODED_BODY_BYTES = 256 * 1024
+
+# Longest text extracted from an HTML-only email body, in characters
+MAX_HTML_TEXT_CHARS = 64 * 1024
+
+# Replies generated at the same time by the auto-responder (see GmailAssistant.generate_emails)
+REPLY_GENERATION_WORKERS = 4
+
+# Seconds an OpenAI request for one auto-response may take; a reply that times out is not sent
+REPLY_GENERATION_TIMEOUT = 60.0
+
+# Generated responses kept in the local store for reuse (see ResponseCache), and for how long
+RESPONSE_CACHE_SIZE = 1000
+RESPONSE_CACHE_TTL = 7 * 24 * 3600  # seconds
+
+# Temperature of the softmax that turns embedding similarities into category probabilities
+# (see EmbeddingClassifier.probabilities). 0.05 is the inverse of the similarity scale of 20
+# that sentence-transformers models such as MiniLM are trained with.
+EMBEDDING_TEMPERATURE = 0.05
@@ -0,0 +1,144 @@
+"""Compact record type for parsed emails."""
+import re
+
+SENDER_NAME_PATTERN = re.compile(r'(.*?)\s*<')
+SENDER_ADDRESS_PATTERN = re.compile(r'<(.*?)>')
+
+# Characters that could cause HTML interpretation issues when shown in Streamlit markdown
+HTML_SANITIZE_REPLACEMENTS = {
+    "<": "&lt;",
+    ">": "&gt;",
+    "&": "&amp;",
+    '"': "&quot;",
+    "'": "&#39;",
+    "@": "&#64;",  # Replace @ with its HTML entity
+}
+
+
+def sender_name(sender):
+    """Extract name from email sender format: 'Name <email@example.com>'"""
+    match = SENDER_NAME_PATTERN.match(sender)
+    if match:
+        return match.group(1).strip()
+    return 'there'  # Fallback if name can't be extracted
+
+
+def sender_address(sender):
+    """Extract email from sender format: 'Name <email@example.com>'"""
+    match = SENDER_ADDRESS_PATTERN.search(sender)
+    if match:
+        return match.group(1)
+    return sender  # Return the whole string if it doesn't match the pattern
+
+
+def sanitize_for_html(text):
+    """
+    Sanitize text to be safely used in HTML.
+    Replaces special characters that might cause rendering issues.
+    """
+    if not text:
+        return ""
+
+    for char, replacement in HTML_SANITIZE_REPLACEMENTS.items():
+        text = text.replace(char, replacement)
+
+    return text
+
+
+class EmailInfo:
+    """A parsed email.
+
+    Uses __slots__ instead of a per-email dict, and computes derived fields
+    (sender name and address, sanitized subject and sender, display date) on first
+    access only. It also supports the dict-style access the code used when emails
+    were plain dicts: email['subject'], email.get('body'), email['body'] = ...,
+    'category' in email, and copy(). A field that is None, like a body that is not
+    loaded yet, still reads as None, but 'category' only counts as present once set.
+    """
+
+    FIELDS = ('id', 'subject', 'sender', 'body', 'snippet', 'date', 'category')
+    DERIVED = ('sender_name', 'sender_address', 'safe_subject', 'safe_sender', 'display_date')
+
+    __slots__ = FIELDS + tuple('_' + name for name in DERIVED)
+
+    def __init__(self, id, subject, sender, body=None, snippet='', date=None, category=None):
+        self.id = id
+        self.subject = subject
+        self.sender = sender
+        self.body = body
+        self.snippet = snippet
+        self.date = date
+        self.category = category
+        for name in self.DERIVED:
+            setattr(self, '_' + name, None)
+
+    def __repr__(self):
+        return f"EmailInfo(id={self.id!r}, subject={self.subject!r}, sender={self.sender!r}, date={self.date!r})"
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS and key not in self.DERIVED:
+            raise KeyError(key)
+        if key == 'category' and self.category is None:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+        if key in ('subject', 'sender', 'date'):
+            # Derived fields depend on these; recompute them on next access
+            for name in self.DERIVED:
+                setattr(self, '_' + name, None)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        """Return a field like dict.get."""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        """Return the names of the fields that are set, like dict.keys."""
+        return [key for key in self.FIELDS if key in self]
+
+    def copy(self):
+        """Return a shallow copy of the record."""
+        return EmailInfo(self.id, self.subject, self.sender, self.body, self.snippet, self.date, self.category)
+
+    @property
+    def sender_name(self):
+        if self._sender_name is None:
+            self._sender_name = sender_name(self.sender)
+        return self._sender_name
+
+    @property
+    def sender_address(self):
+        if self._sender_address is None:
+            self._sender_address = sender_address(self.sender)
+        return self._sender_address
+
+    @property
+    def safe_subject(self):
+        if self._safe_subject is None:
+            self._safe_subject = sanitize_for_html(self.subject)
+        return self._safe_subject
+
+    @property
+    def safe_sender(self):
+        if self._safe_sender is None:
+            self._safe_sender = sanitize_for_html(self.sender)
+        return self._safe_sender
+
+    @property
+    def display_date(self):
+        if self._display_date is None:
+            self._display_date = self.date.strftime('%Y-%m-%d %H:%M') if self.date is not None else ''
+        return self._display_date
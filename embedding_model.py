@@ -0,0 +1,150 @@
+"""Optional semantic email classifier using a local sentence-embedding model on CPU."""
+import hashlib
+
+import numpy as np
+import torch
+
+from constants import EMBEDDING_TEMPERATURE
+from text_model import email_text
+
+
+class EmbeddingClassifier:
+    """Nearest-centroid classifier over sentence embeddings of subject + body.
+
+    The embedding model (e.g. a MiniLM sentence-transformers checkpoint) is loaded
+    with transformers from a directory on disk with local_files_only=True, so it
+    never touches the network. Texts are embedded on CPU in padded batches under
+    torch.inference_mode(), sorted by length so each batch pads as little as possible,
+    and mean-pooled into unit vectors. Embeddings are cached per message ID, so
+    sorting the same emails again never re-embeds them. An email is filed under the
+    category whose centroid is most similar. Its confidence is that category's
+    probability under a softmax of the similarities divided by temperature, so it
+    is comparable with the probabilities of the other engines.
+    """
+
+    def __init__(self, model_dir, num_threads=None, batch_size=32, max_length=256, temperature=EMBEDDING_TEMPERATURE):
+        try:
+            from transformers import AutoModel, AutoTokenizer
+        except ImportError as e:
+            raise ImportError("The embedding classifier requires the 'transformers' package") from e
+
+        if num_threads:
+            # Applies to the whole process: torch keeps a single intra-op thread pool
+            torch.set_num_threads(num_threads)
+        self.model_dir = model_dir
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.temperature = temperature
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir, local_files_only=True)
+        self.model = AutoModel.from_pretrained(model_dir, local_files_only=True).to('cpu').eval()
+
+        self.cache = {}  # message_id -> unit embedding
+        self.categories = []
+        self.centroids = np.zeros((0, self.model.config.hidden_size), dtype=np.float32)
+        self.fingerprint = None  # hash of the current centroids, identifies their version
+
+    def embed(self, texts):
+        """Return an (n_texts, hidden_size) array of unit-length embeddings."""
+        embeddings = np.zeros((len(texts), self.model.config.hidden_size), dtype=np.float32)
+        # Batching texts of similar length keeps padding, and wasted compute, to a minimum
+        order = sorted(range(len(texts)), key=lambda index: len(texts[index]))
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            encoded = self.tokenizer(
+                [texts[index] for index in batch],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors='pt'
+            )
+            with torch.inference_mode():
+                hidden = self.model(**encoded).last_hidden_state
+                # Mean over real tokens only, ignoring padding
+                mask = encoded['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+                pooled = torch.nn.functional.normalize(pooled, dim=1)
+            embeddings[batch] = pooled.numpy()
+        return embeddings
+
+    def embed_emails(self, email_infos):
+        """Return embeddings for email_infos, embedding only the emails not cached yet."""
+        missing = [email_info for email_info in email_infos if email_info['id'] not in self.cache]
+        if missing:
+            for email_info, embedding in zip(missing, self.embed([email_text(email_info) for email_info in missing])):
+                self.cache[email_info['id']] = embedding
+        return np.stack([self.cache[email_info['id']] for email_info in email_infos]) if email_infos else (
+            np.zeros((0, self.model.config.hidden_size), dtype=np.float32)
+        )
+
+    @property
+    def ready(self):
+        """True once category centroids are available."""
+        return bool(self.categories)
+
+    def fit(self, email_infos, labels):
+        """Compute one centroid per category from labeled emails."""
+        embeddings = self.embed_emails(email_infos)
+        labels = np.asarray(labels, dtype=object)
+        self._set_centroids({
+            category: embeddings[labels == category].mean(axis=0)
+            for category in dict.fromkeys(labels.tolist())
+        })
+        return self
+
+    def fit_keywords(self, rules):
+        """Compute centroids from category keyword rules, for use before any labeled emails exist."""
+        self._set_centroids({
+            category: self.embed(list(keywords)).mean(axis=0)
+            for category, keywords in rules.items() if keywords
+        })
+        return self
+
+    def _set_centroids(self, centroids):
+        """Use {category: mean embedding} as the centroids, normalized to unit length."""
+        self.categories = list(centroids)
+        matrix = np.stack(list(centroids.values())) if centroids else self.centroids[:0]
+        self.centroids = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-9)
+        self._update_fingerprint()
+
+    def _update_fingerprint(self):
+        """Hash the categories and centroids so callers can tell when they change."""
+        digest = hashlib.sha1('\0'.join(self.categories).encode('utf-8'))
+        digest.update(np.ascontiguousarray(self.centroids, dtype=np.float32).tobytes())
+        self.fingerprint = digest.hexdigest()
+
+    def similarities(self, email_infos):
+        """Return an (n_emails, n_categories) array of cosine similarities to each centroid."""
+        return self.embed_emails(email_infos) @ self.centroids.T
+
+    def probabilities(self, email_infos):
+        """Return an (n_emails, n_categories) array of category probabilities.
+
+        Raw cosine similarities to keyword or label centroids sit in a narrow band
+        well below 1, so they cannot be compared with a probability threshold. A
+        softmax over similarity / temperature turns the margin between categories
+        into a probability instead.
+        """
+        logits = self.similarities(email_infos) / self.temperature
+        logits -= logits.max(axis=1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def predict(self, email_infos):
+        """Return the most probable (category, probability) for each email."""
+        probabilities = self.probabilities(email_infos)
+        best = probabilities.argmax(axis=1)
+        return [(self.categories[index], float(probabilities[row, index])) for row, index in enumerate(best)]
+
+    def save_centroids(self, path):
+        """Save the category centroids to an .npz file."""
+        np.savez(path, categories=np.array(self.categories, dtype=str), centroids=self.centroids)
+
+    def load_centroids(self, path):
+        """Load centroids saved with save_centroids(); raises ValueError if they come from a model of another size."""
+        with np.load(path) as data:
+            if data['centroids'].shape[1] != self.model.config.hidden_size:
+                raise ValueError(f"centroids in {path} do not match the embedding size of {self.model_dir}")
+            self.categories = [str(category) for category in data['categories']]
+            self.centroids = data['centroids']
+        self._update_fingerprint()
+        return self
@@ -0,0 +1,167 @@
+"""Client-side Gmail quota limiting with exponential backoff retries."""
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from googleapiclient.errors import HttpError
+
+from constants import (
+    GMAIL_QUOTA_UNITS, GMAIL_QUOTA_UNITS_PER_SECOND,
+    GMAIL_MAX_RETRIES, GMAIL_BACKOFF_BASE, GMAIL_BACKOFF_MAX
+)
+
+# HTTP statuses worth retrying for idempotent calls
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Statuses that mean the request was rejected before Gmail acted on it
+THROTTLED_STATUSES = {429}
+
+# 403 responses carrying these reasons are quota throttling rather than permission errors
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+# Calls that must not be repeated after a server error, since the first attempt may have gone through
+NON_IDEMPOTENT_METHODS = {'messages.send', 'drafts.send'}
+
+
+class TokenBucket:
+    """Thread-safe token bucket measured in Gmail quota units.
+
+    Callers reserve units up front; when the bucket runs dry they sleep until enough
+    units have been refilled, which keeps the sustained rate at `rate` units per second.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, units):
+        """Take units from the bucket and return how long the caller must wait before using them."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= min(units, self.capacity)
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self, units=1):
+        """Block until `units` quota units are available."""
+        wait = self._reserve(units)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, units=1):
+        """Wait without blocking the event loop until `units` quota units are available."""
+        wait = self._reserve(units)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def penalize(self, seconds):
+        """Hold back every caller for `seconds` after the server reported throttling."""
+        with self._lock:
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class GmailRateLimiter:
+    """Shared quota limiter and retry policy for Gmail API calls.
+
+    Every call reserves its method's quota units from a token bucket before it is sent.
+    Throttled (429, 403 rate limit) and transient server errors are retried with
+    exponential backoff and full jitter, honoring Retry-After when the server sends it.
+    """
+
+    def __init__(self, units_per_second=GMAIL_QUOTA_UNITS_PER_SECOND, max_retries=GMAIL_MAX_RETRIES,
+                 backoff_base=GMAIL_BACKOFF_BASE, backoff_max=GMAIL_BACKOFF_MAX):
+        self.bucket = TokenBucket(units_per_second)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retries = 0  # total number of retried calls, for diagnostics
+
+    def units(self, method):
+        """Return the quota cost of a Gmail method."""
+        return GMAIL_QUOTA_UNITS.get(method, 5)
+
+    def acquire(self, method, count=1):
+        """Reserve quota for `count` calls of `method`, blocking if needed."""
+        self.bucket.acquire(self.units(method) * count)
+
+    async def acquire_async(self, method, count=1):
+        """Reserve quota for `count` calls of `method` without blocking the event loop."""
+        await self.bucket.acquire_async(self.units(method) * count)
+
+    def should_retry(self, method, status, content=''):
+        """Return True if a failed call with this HTTP status may be retried."""
+        throttled = status in THROTTLED_STATUSES or (
+            status == 403 and any(reason in content for reason in RATE_LIMIT_REASONS)
+        )
+        if throttled:
+            return True
+        return status in RETRYABLE_STATUSES and method not in NON_IDEMPOTENT_METHODS
+
+    def should_retry_error(self, method, error):
+        """Return True if an exception raised by a googleapiclient call may be retried."""
+        if not isinstance(error, HttpError):
+            return False
+        content = error.content.decode('utf-8', 'replace') if isinstance(error.content, bytes) else str(error.content)
+        return self.should_retry(method, error.resp.status, content)
+
+    def retry_delay(self, attempt, retry_after=None):
+        """Return the delay before retry number `attempt` (0-based), honoring Retry-After."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        server_delay = parse_retry_after(retry_after)
+        if server_delay is not None:
+            delay = max(delay, server_delay)
+        return delay
+
+    def backoff(self, method, attempt, status, retry_after=None):
+        """Sleep before a retry and slow every other caller down as well."""
+        delay = self.retry_delay(attempt, retry_after)
+        self.retries += 1
+        if status in THROTTLED_STATUSES or status == 403:
+            self.bucket.penalize(delay)
+        print(f"[WARNING] Gmail {method} failed with HTTP {status}, retrying in {delay:.1f}s "
+              f"(attempt {attempt + 1}/{self.max_retries})")
+        return delay
+
+    def execute(self, request, method):
+        """Execute a googleapiclient request under the quota limiter, retrying transient failures."""
+        for attempt in range(self.max_retries + 1):
+            self.acquire(method)
+            try:
+                return request.execute()
+            except HttpError as e:
+                if attempt == self.max_retries or not self.should_retry_error(method, e):
+                    raise
+                time.sleep(self.backoff(method, attempt, e.resp.status, e.resp.get('retry-after')))
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header (seconds or HTTP date) into seconds, or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+_shared_limiter = None
+_shared_lock = threading.Lock()
+
+
+def shared_rate_limiter():
+    """Return the process-wide limiter, so every assistant for the mailbox draws on one quota."""
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None:
+            _shared_limiter = GmailRateLimiter()
+        return _shared_limiter
@@ -0,0 +1,113 @@
+"""Plain-text extraction from HTML email bodies."""
+from html.parser import HTMLParser
+
+from constants import MAX_DECODED_BODY_BYTES, MAX_HTML_TEXT_CHARS
+
+# Elements whose content is never shown to the reader
+SKIPPED_TAGS = {'script', 'style', 'title', 'template', 'noscript', 'svg'}
+
+# Elements that start a new paragraph (a blank line) or a new line of text
+PARAGRAPH_TAGS = {'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'table', 'blockquote'}
+LINE_TAGS = {
+    'div', 'br', 'hr', 'li', 'ul', 'ol', 'tr', 'thead', 'tbody', 'tfoot', 'pre', 'section',
+    'article', 'header', 'footer', 'nav', 'aside', 'center', 'dl', 'dt', 'dd', 'form', 'address'
+}
+
+# Elements that separate words without starting a new line
+WORD_TAGS = {'td', 'th', 'img', 'input', 'button'}
+
+# Separators between words, weakest first
+SEPARATOR_RANK = {'': 0, ' ': 1, '\n': 2, '\n\n': 3}
+
+# Input is fed to the parser in slices of this many characters
+FEED_CHUNK_CHARS = 64 * 1024
+
+
+class _TextExtractor(HTMLParser):
+    """HTMLParser that collects visible text with collapsed whitespace, up to max_chars characters."""
+
+    def __init__(self, max_chars):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.chunks = []
+        self.length = 0
+        self.skip_depth = 0
+        self.pending = ''  # separator to write before the next word
+        self.full = False
+
+    def _separate(self, separator):
+        """Keep the strongest separator seen since the last word."""
+        if SEPARATOR_RANK[separator] > SEPARATOR_RANK[self.pending]:
+            self.pending = separator
+
+    def _boundary(self, tag):
+        """Record the separator implied by an opening or closing tag."""
+        if tag in PARAGRAPH_TAGS:
+            self._separate('\n\n')
+        elif tag in LINE_TAGS:
+            self._separate('\n')
+        elif tag in WORD_TAGS:
+            self._separate(' ')
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self.skip_depth += 1
+        else:
+            self._boundary(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        # Self-closing <script/> or <style/> has no content to skip
+        if tag not in SKIPPED_TAGS:
+            self._boundary(tag)
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        else:
+            self._boundary(tag)
+
+    def handle_data(self, data):
+        if self.skip_depth or self.full:
+            return
+        words = data.split()
+        if not words:
+            if data:
+                self._separate(' ')
+            return
+        if data[0].isspace():
+            self._separate(' ')
+
+        text = ' '.join(words)
+        if self.chunks and self.pending:
+            text = self.pending + text
+        self.pending = ''
+        if self.length + len(text) >= self.max_chars:
+            text = text[:self.max_chars - self.length]
+            self.full = True
+        self.chunks.append(text)
+        self.length += len(text)
+
+        if data[-1].isspace():
+            self._separate(' ')
+
+
+def html_to_text(html, max_chars=MAX_HTML_TEXT_CHARS, max_input_chars=MAX_DECODED_BODY_BYTES):
+    """Return the visible text of an HTML document.
+
+    The document is fed to html.parser in fixed-size slices, so the work is linear
+    in the input and stops as soon as max_chars characters of text were produced
+    or max_input_chars characters of HTML were read. Script, style and other
+    invisible elements are dropped, runs of whitespace collapse to one space, and
+    block elements become line breaks (at most one blank line in a row).
+    """
+    if not html:
+        return ''
+    parser = _TextExtractor(max_chars)
+    end = min(len(html), max_input_chars)
+    for start in range(0, end, FEED_CHUNK_CHARS):
+        parser.feed(html[start:min(start + FEED_CHUNK_CHARS, end)])
+        if parser.full:
+            break
+    else:
+        parser.close()
+    return ''.join(parser.chunks)
@@ -0,0 +1,101 @@
+"""Queued label changes for the Gmail Assistant, applied with messages().batchModify."""
+import threading
+import time
+
+# Gmail accepts at most 1000 message IDs per batchModify call
+BATCH_MODIFY_LIMIT = 1000
+
+
+class LabelChangeQueue:
+    """Collect label changes and apply them in bulk.
+
+    Changes are grouped by the labels they add and remove, and each group is sent
+    as users().messages().batchModify calls of up to BATCH_MODIFY_LIMIT IDs. When
+    add() queues a change, the queue flushes itself if max_batch IDs are waiting
+    or the oldest queued change is at least flush_interval seconds old. There is
+    no timer: changes stay queued until the next add() or flush(), so call flush()
+    once done to apply the rest. If a batchModify call fails its IDs are retried
+    one by one with modify; IDs that still fail during an automatic flush are kept
+    and returned by the next flush().
+    """
+
+    def __init__(self, assistant, max_batch=BATCH_MODIFY_LIMIT, flush_interval=30.0):
+        self.assistant = assistant
+        self.max_batch = min(max_batch, BATCH_MODIFY_LIMIT)
+        self.flush_interval = flush_interval
+        self.pending = {}  # (add_labels, remove_labels) -> {message_id: None}, keeps insertion order
+        self.oldest = None
+        self.failed = []  # IDs that failed in automatic flushes, reported by the next flush()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(ids) for ids in self.pending.values())
+
+    def add(self, message_ids, add_labels=(), remove_labels=()):
+        """Queue a label change for message_ids, flushing if the size or interval limit is reached."""
+        key = (tuple(sorted(add_labels)), tuple(sorted(remove_labels)))
+        with self._lock:
+            queued = self.pending.setdefault(key, {})
+            for message_id in message_ids:
+                queued[message_id] = None
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+            size = sum(len(ids) for ids in self.pending.values())
+            due = time.monotonic() - self.oldest >= self.flush_interval
+
+        if size >= self.max_batch or due:
+            failed = self._apply()
+            with self._lock:
+                self.failed.extend(failed)
+
+    def flush(self):
+        """Apply all queued changes; returns the IDs that could not be modified, including
+        those that failed in automatic flushes since the last call."""
+        failed = self._apply()
+        with self._lock:
+            failed, self.failed = self.failed + failed, []
+        return failed
+
+    def _apply(self):
+        """Send every queued change; returns the IDs that could not be modified."""
+        with self._lock:
+            pending, self.pending, self.oldest = self.pending, {}, None
+
+        failed = []
+        for (add_labels, remove_labels), queued in pending.items():
+            message_ids = list(queued)
+            body = {}
+            if add_labels:
+                body['addLabelIds'] = list(add_labels)
+            if remove_labels:
+                body['removeLabelIds'] = list(remove_labels)
+
+            for start in range(0, len(message_ids), BATCH_MODIFY_LIMIT):
+                chunk = message_ids[start:start + BATCH_MODIFY_LIMIT]
+                try:
+                    self.assistant._execute(self.assistant.service.users().messages().batchModify(
+                        userId=self.assistant.user_id,
+                        body=dict(body, ids=chunk)
+                    ), 'messages.batchModify')
+                except Exception as e:
+                    print(f"[WARNING] batchModify of {len(chunk)} emails failed, modifying one by one: {e}")
+                    failed.extend(self._modify_each(chunk, body))
+
+        return failed
+
+    def _modify_each(self, message_ids, body):
+        """Apply a label change to each message individually; returns the IDs that failed."""
+        failed = []
+        for message_id in message_ids:
+            try:
+                self.assistant._execute(self.assistant.service.users().messages().modify(
+                    userId=self.assistant.user_id,
+                    id=message_id,
+                    body=body,
+                    fields=self.assistant._fields('messages.modify')
+                ), 'messages.modify')
+            except Exception as e:
+                print(f"Error modifying labels of email {message_id}: {e}")
+                failed.append(message_id)
+        return failed
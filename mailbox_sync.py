@@ -0,0 +1,154 @@
+"""Incremental mailbox synchronisation for the Gmail Assistant using Gmail history IDs."""
+from googleapiclient.errors import HttpError
+
+# History record types that can change whether a message belongs in the unread view
+HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+
+# Labels that take a message out of the unread view even if it is still unread
+EXCLUDED_LABELS = {'TRASH', 'SPAM'}
+
+
+class MailboxSync:
+    """Keep an in-memory categorized view of unread emails in sync with the mailbox.
+
+    The first sync does a full listing and records the mailbox historyId. Later syncs
+    ask users().history().list for the changes since that ID and only download messages
+    that became unread, so a refresh costs O(changes) instead of O(unread). Messages
+    whose download fails are kept in pending_ids and fetched again on the next sync,
+    since the history after the new historyId will not mention them again.
+    """
+
+    def __init__(self, assistant, max_results=20):
+        self.assistant = assistant
+        self.max_results = max_results
+        self.history_id = None
+        self.view = {}  # category -> {message_id: email_info}
+        self.locations = {}  # message_id -> category
+        self.pending_ids = set()  # unread messages whose download failed, retried on the next sync
+
+    def sync(self):
+        """Bring the view up to date and return it as category -> list of emails."""
+        if self.history_id is None:
+            return self.full_resync()
+
+        try:
+            records, history_id = self._list_history()
+        except HttpError as e:
+            if e.resp.status == 404:
+                # The stored history ID is too old (Gmail keeps roughly a week of history)
+                print("[INFO] Mailbox history ID expired, running a full resync")
+                return self.full_resync()
+            print(f"Error reading mailbox history: {e}")
+            return self.categories()
+        except Exception as e:
+            print(f"Error reading mailbox history: {e}")
+            return self.categories()
+
+        self._apply(records)
+        self.history_id = history_id
+        return self.categories()
+
+    def full_resync(self):
+        """Rebuild the view from a full listing of unread emails."""
+        service = self.assistant.service
+        try:
+            # Read the history ID before listing so no change made during the listing is lost
+            profile = self.assistant._execute(service.users().getProfile(
+                userId=self.assistant.user_id,
+                fields=self.assistant._fields('getProfile')
+            ), 'getProfile')
+            history_id = profile.get('historyId')
+        except Exception as e:
+            print(f"Error getting mailbox history ID: {e}")
+            history_id = None
+
+        self.view = {category: {} for category in self.assistant._empty_categories()}
+        self.locations = {}
+        self.pending_ids = set()
+        try:
+            message_ids = self.assistant.list_unread_ids(max_results=self.max_results)
+        except Exception as e:
+            print(f"Error retrieving emails: {e}")
+            message_ids = []
+        for email_info, category in self.assistant.load_emails(message_ids):
+            self._add(email_info, category)
+
+        self.history_id = history_id
+        return self.categories()
+
+    def categories(self):
+        """Return the view in the shape returned by GmailAssistant.sort_emails, newest first."""
+        return {
+            category: sorted(emails.values(), key=lambda e: e['date'], reverse=True)
+            for category, emails in self.view.items()
+        }
+
+    def _list_history(self):
+        """Return all history records since self.history_id and the latest history ID."""
+        service = self.assistant.service
+        records = []
+        history_id = self.history_id
+        page_token = None
+
+        while True:
+            response = self.assistant._execute(service.users().history().list(
+                userId=self.assistant.user_id,
+                startHistoryId=self.history_id,
+                historyTypes=HISTORY_TYPES,
+                pageToken=page_token,
+                fields=self.assistant._fields('history.list')
+            ), 'history.list')
+
+            records.extend(response.get('history', []))
+            history_id = response.get('historyId', history_id)
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return records, history_id
+
+    def _apply(self, records):
+        """Apply history records to the view, fetching only newly unread messages."""
+        # Reduce the records to the final unread state of each touched message
+        unread = {}
+        for record in records:
+            for change in record.get('messagesDeleted', []):
+                unread[change['message']['id']] = False
+            for key in ('messagesAdded', 'labelsAdded', 'labelsRemoved'):
+                for change in record.get(key, []):
+                    labels = set(change['message'].get('labelIds', []))
+                    unread[change['message']['id']] = 'UNREAD' in labels and not labels & EXCLUDED_LABELS
+
+        for message_id, is_unread in unread.items():
+            if not is_unread:
+                self._remove(message_id)
+                self.pending_ids.discard(message_id)
+
+        # Messages that failed to download last time are not in these records again
+        new_ids = [message_id for message_id in self.pending_ids if unread.get(message_id, True)]
+        new_ids += [message_id for message_id, is_unread in unread.items()
+                    if is_unread and message_id not in self.locations and message_id not in self.pending_ids]
+        loaded = 0
+        if new_ids:
+            for email_info, category in self.assistant.load_emails(new_ids):
+                self._add(email_info, category)
+                loaded += 1
+        self.pending_ids = {message_id for message_id in new_ids if message_id not in self.locations}
+
+        print(f"[DEBUG] Mailbox sync applied {len(records)} history records, loaded {loaded} new emails")
+        if self.pending_ids:
+            print(f"[WARNING] Could not download {len(self.pending_ids)} new emails, retrying them on the next sync")
+
+    def move(self, email_info, category):
+        """Refile an email in the view, e.g. after the user recategorized it."""
+        self._remove(email_info['id'])
+        self._add(email_info, category)
+
+    def _add(self, email_info, category):
+        """File a classified email in the view."""
+        self.view[category][email_info['id']] = email_info
+        self.locations[email_info['id']] = category
+
+    def _remove(self, message_id):
+        """Drop a message from the view if present."""
+        category = self.locations.pop(message_id, None)
+        if category is not None:
+            self.view[category].pop(message_id, None)
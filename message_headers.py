@@ -0,0 +1,50 @@
+"""Header lookup and date parsing for Gmail API messages."""
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+
+# Distinct Date header strings remembered by parse_date_header
+DATE_CACHE_SIZE = 4096
+
+
+def header_index(headers):
+    """Return {lowercased header name: value} for a header list, built in one pass.
+
+    When a header appears more than once the first occurrence wins, as with the
+    previous next(...) lookups.
+    """
+    index = {}
+    for header in headers:
+        index.setdefault(header['name'].lower(), header['value'])
+    return index
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_date_header(value):
+    """Parse an RFC 2822 Date header into an aware datetime in local time, or None.
+
+    Memoized, since listings repeat the same Date strings (threads, bulk mail).
+    Headers without a timezone are taken as UTC, as RFC 2822 '-0000' dates are.
+    """
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone()
+
+
+def message_date(index, internal_date=None):
+    """Return the date of a message from its Date header, else Gmail's internalDate, else now.
+
+    The result is always an aware datetime in local time, so dates of different
+    messages can be compared and sorted.
+    """
+    date = parse_date_header(index['date']) if index.get('date') else None
+    if date is None and internal_date:
+        try:
+            date = datetime.fromtimestamp(int(internal_date) / 1000).astimezone()
+        except (TypeError, ValueError, OverflowError):
+            date = None
+    return date or datetime.now().astimezone()
@@ -0,0 +1,214 @@
+"""Persistent local store of parsed emails and their classifications."""
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from email_info import EmailInfo
+
+# SQLite limits the number of bound parameters per statement; stay well below it
+MAX_QUERY_IDS = 500
+
+# Classifier version of categories chosen by the user, which are never reclassified
+USER_VERSION = 'user'
+
+
+def _load_date(value):
+    """Parse a stored ISO date; dates stored before they were timezone-aware are taken as local time."""
+    date = datetime.fromisoformat(value)
+    return date if date.tzinfo else date.astimezone()
+
+
+class MessageStore:
+    """SQLite-backed cache of parsed emails keyed by Gmail message ID.
+
+    Gmail message content never changes once delivered, so a parsed email and its
+    classification can be reused across Streamlit sessions and CLI runs. Only
+    message IDs that are not in the store need to be downloaded and parsed. A NULL
+    body means the email was stored from metadata only and its body is not loaded yet;
+    the snippet is kept so such emails are reclassified from the same text.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # Streamlit reruns the script on different threads, so the connection is shared behind a lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    id TEXT PRIMARY KEY,
+                    subject TEXT,
+                    sender TEXT,
+                    body TEXT,
+                    date TEXT,
+                    category TEXT,
+                    confidence REAL,
+                    internal_date INTEGER,
+                    history_id TEXT,
+                    updated_at REAL,
+                    classifier_version TEXT,
+                    snippet TEXT
+                )
+            """)
+            # Stores created before categories were versioned, or before snippets were kept, lack the columns
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(messages)")}
+            if 'classifier_version' not in columns:
+                self.conn.execute("ALTER TABLE messages ADD COLUMN classifier_version TEXT")
+            if 'snippet' not in columns:
+                self.conn.execute("ALTER TABLE messages ADD COLUMN snippet TEXT")
+
+    def get_many(self, message_ids):
+        """Return {message_id: (EmailInfo, category, confidence, classifier_version)} for the IDs present in the store."""
+        found = {}
+        message_ids = list(message_ids)
+        with self._lock:
+            for start in range(0, len(message_ids), MAX_QUERY_IDS):
+                chunk = message_ids[start:start + MAX_QUERY_IDS]
+                rows = self.conn.execute(
+                    f"SELECT id, subject, sender, body, snippet, date, category, confidence, classifier_version FROM messages "
+                    f"WHERE id IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                for message_id, subject, sender, body, snippet, date, category, confidence, version in rows:
+                    email_info = EmailInfo(
+                        id=message_id,
+                        subject=subject,
+                        sender=sender,
+                        body=body,
+                        snippet=snippet or '',
+                        date=_load_date(date)
+                    )
+                    found[message_id] = (email_info, category, confidence, version)
+        return found
+
+    def iter_emails(self, chunk_size=1000):
+        """Yield every stored email as lists of EmailInfo records, chunk_size at a time."""
+        last_id = ''
+        while True:
+            with self._lock:
+                rows = self.conn.execute(
+                    "SELECT id, subject, sender, body, snippet, date FROM messages WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, chunk_size)
+                ).fetchall()
+            if not rows:
+                return
+            yield [
+                EmailInfo(
+                    id=message_id,
+                    subject=subject,
+                    sender=sender,
+                    body=body,
+                    snippet=snippet or '',
+                    date=_load_date(date)
+                )
+                for message_id, subject, sender, body, snippet, date in rows
+            ]
+            last_id = rows[-1][0]
+
+    def iter_labeled(self, chunk_size=1000):
+        """Yield every stored email with its category as lists of (email_info, category), chunk_size at a time."""
+        last_id = ''
+        while True:
+            with self._lock:
+                rows = self.conn.execute(
+                    "SELECT id, subject, sender, body, snippet, date, category FROM messages WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, chunk_size)
+                ).fetchall()
+            if not rows:
+                return
+            yield [
+                (
+                    EmailInfo(
+                        id=message_id,
+                        subject=subject,
+                        sender=sender,
+                        body=body,
+                        snippet=snippet or '',
+                        date=_load_date(date)
+                    ),
+                    category
+                )
+                for message_id, subject, sender, body, snippet, date, category in rows
+            ]
+            last_id = rows[-1][0]
+
+    def update_categories(self, classifications, classifier_version=None):
+        """Update stored classifications from (message_id, category, confidence) tuples.
+
+        Categories chosen by the user (classifier_version USER_VERSION) are only
+        replaced by another choice of the user.
+        """
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "UPDATE messages SET category = ?, confidence = ?, classifier_version = ?, updated_at = ? "
+                "WHERE id = ? AND (classifier_version IS NULL OR classifier_version != ? OR ? = ?)",
+                [
+                    (category, confidence, classifier_version, now, message_id, USER_VERSION, classifier_version, USER_VERSION)
+                    for message_id, category, confidence in classifications
+                ]
+            )
+
+    def put(self, email_info, category, confidence, internal_date=None, history_id=None, classifier_version=None):
+        """Insert or replace the stored entry for one email."""
+        self.put_many([(email_info, category, confidence, internal_date, history_id)], classifier_version)
+
+    def put_many(self, entries, classifier_version=None):
+        """Insert or replace entries of (email_info, category, confidence, internal_date, history_id).
+
+        classifier_version records which rules or model produced the categories.
+        """
+        now = time.time()
+        rows = [
+            (
+                email_info['id'],
+                email_info['subject'],
+                email_info['sender'],
+                email_info['body'],
+                email_info['date'].isoformat(),
+                category,
+                confidence,
+                int(internal_date) if internal_date else None,
+                history_id,
+                now,
+                classifier_version,
+                email_info.get('snippet') or ''
+            )
+            for email_info, category, confidence, internal_date, history_id in entries
+        ]
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO messages "
+                "(id, subject, sender, body, date, category, confidence, internal_date, history_id, updated_at, "
+                "classifier_version, snippet) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def update_body(self, message_id, body):
+        """Store the body of an email that was first saved from metadata only."""
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE messages SET body = ?, updated_at = ? WHERE id = ?",
+                (body, time.time(), message_id)
+            )
+
+    def update_bodies(self, bodies):
+        """Store the bodies of emails first saved from metadata only, from (message_id, body) pairs."""
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "UPDATE messages SET body = ?, updated_at = ? WHERE id = ?",
+                [(body, now, message_id) for message_id, body in bodies]
+            )
+
+    def delete(self, message_ids):
+        """Remove entries from the store."""
+        with self._lock, self.conn:
+            self.conn.executemany("DELETE FROM messages WHERE id = ?", [(i,) for i in message_ids])
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            self.conn.close()
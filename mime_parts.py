@@ -0,0 +1,84 @@
+"""Locate and decode the text body of a Gmail API message payload."""
+import base64
+import codecs
+import re
+
+from constants import MAX_DECODED_BODY_BYTES
+
+CHARSET_PATTERN = re.compile(r'charset\s*=\s*"?([^";\s]+)', re.IGNORECASE)
+
+# Leaf types that never hold the readable body
+SKIPPED_TYPE_PREFIXES = ('image/', 'audio/', 'video/', 'application/', 'font/', 'model/')
+
+
+def _header(part, name):
+    """Return the value of a header of a MIME part, or ''."""
+    name = name.lower()
+    for header in part.get('headers', ()):
+        if header.get('name', '').lower() == name:
+            return header.get('value', '')
+    return ''
+
+
+def is_attachment(part):
+    """True for parts that are attachments or non-text media, which are never decoded."""
+    mime_type = part.get('mimeType', '').lower()
+    if mime_type.startswith(SKIPPED_TYPE_PREFIXES):
+        return True
+    if part.get('filename'):
+        return True
+    return _header(part, 'Content-Disposition').strip().lower().startswith('attachment')
+
+
+def find_text_parts(payload):
+    """Return the first text/plain and the first text/html part of a payload, in document order.
+
+    The MIME tree is walked iteratively with an explicit stack, so deeply nested
+    multipart/mixed > multipart/related > multipart/alternative messages cost one
+    pass and no recursion. The walk stops as soon as a text/plain part is found.
+    Attachment and media parts are skipped without being decoded. Either result is
+    None if the message has no such part.
+    """
+    plain = html = None
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        mime_type = part.get('mimeType', '').lower()
+        if mime_type.startswith('multipart/') or (part.get('parts') and not mime_type.startswith('text/')):
+            # Children are pushed in reverse so they are visited in document order
+            stack.extend(reversed(part.get('parts', [])))
+            continue
+        if is_attachment(part) or 'data' not in part.get('body', {}):
+            continue
+        if mime_type == 'text/html':
+            html = html or part
+        elif mime_type in ('text/plain', ''):
+            plain = part
+            break
+    return plain, html
+
+
+def decode_part(part, max_bytes=MAX_DECODED_BODY_BYTES):
+    """Decode the body of a MIME part into text with its declared charset.
+
+    At most max_bytes bytes are decoded: the base64 data is sliced before decoding,
+    so a huge part is never materialized in memory. Unknown charsets fall back to
+    UTF-8 and undecodable bytes are replaced instead of raising.
+    """
+    data = part.get('body', {}).get('data', '')
+    if not data:
+        return ''
+    # Every 4 base64 characters decode to 3 bytes
+    truncated = len(data) > ((max_bytes + 2) // 3) * 4
+    if truncated:
+        data = data[:((max_bytes + 2) // 3) * 4]
+    raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))[:max_bytes]
+
+    match = CHARSET_PATTERN.search(_header(part, 'Content-Type'))
+    charset = match.group(1) if match else 'utf-8'
+    try:
+        decoder = codecs.getincrementaldecoder(charset)(errors='replace')
+    except LookupError:
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    # A truncated body may end inside a multi-byte character; leave it out rather than garble it
+    return decoder.decode(raw, final=not truncated)
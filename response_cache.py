@@ -0,0 +1,94 @@
+"""Persistent cache of OpenAI completions keyed by the request that produced them."""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from constants import RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL
+
+
+class ResponseCache:
+    """Generated texts stored in a response_cache table in SQLite.
+
+    Entries are keyed by a hash of (model, prompt, temperature, max_tokens), see
+    key(). An entry older than ttl seconds is never returned and is deleted on the
+    next write; beyond max_entries the least recently used entries are evicted.
+    Only callers that opt in (GmailAssistant.generate_text(use_cache=True)) read
+    from the cache, so a request that should produce a fresh text still can.
+    """
+
+    def __init__(self, path, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    text TEXT,
+                    created_at REAL,
+                    last_used REAL
+                )
+            """)
+
+    @staticmethod
+    def key(model, prompt, temperature, max_tokens):
+        """Return the cache key of a completion request."""
+        request = json.dumps([model, prompt, temperature, max_tokens], ensure_ascii=False)
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached text for key, or None if there is none or it expired."""
+        now = time.time()
+        with self._lock, self.conn:
+            row = self.conn.execute(
+                "SELECT text FROM response_cache WHERE key = ? AND created_at >= ?", (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE response_cache SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, text):
+        """Store the text generated for key, then drop expired and least recently used entries."""
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, text, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, text, now, now)
+            )
+            self.conn.execute("DELETE FROM response_cache WHERE created_at < ?", (now - self.ttl,))
+            self.conn.execute(
+                "DELETE FROM response_cache WHERE key IN "
+                "(SELECT key FROM response_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def clear(self):
+        """Drop every cached text."""
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM response_cache")
+
+    def stats(self):
+        """Return the hit/miss counters and current size."""
+        with self._lock:
+            size = self.conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'size': size
+            }
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,138 @@
+"""Sender reputation index used to categorize mail from predictable senders without classifying it."""
+import sqlite3
+import threading
+
+from constants import SENDER_FAST_PATH_MIN_EMAILS, SENDER_FAST_PATH_MIN_SHARE
+
+# Categories that are never assigned through the fast path, since they ask for a closer look
+UNSTABLE_CATEGORIES = {'needs_review', 'rules_in_training'}
+
+# Mailbox providers shared by unrelated senders; their domains never stand for one sender
+SHARED_MAIL_DOMAINS = {
+    'gmail.com', 'googlemail.com', 'outlook.com', 'hotmail.com', 'live.com', 'msn.com',
+    'yahoo.com', 'ymail.com', 'icloud.com', 'me.com', 'mac.com', 'aol.com', 'proton.me',
+    'protonmail.com', 'gmx.com', 'gmx.de', 'gmx.net', 'web.de', 'mail.com', 'zoho.com',
+    'yandex.com', 'yandex.ru', 'mail.ru', 'qq.com', '163.com', '126.com', 'fastmail.com',
+    'hey.com', 'tutanota.com'
+}
+
+
+class SenderIndex:
+    """Per-sender and per-domain counts of the categories their emails were filed under.
+
+    Keys are the lowercased sender address ('billing@example.com') and its domain
+    ('@example.com'). An address counts its emails; a domain counts its distinct
+    senders, by the category of each sender's first email, so one busy sender
+    cannot make its whole domain look stable. Counts are kept in memory and written
+    incrementally to a sender_stats table in SQLite by flush(). A key with at least
+    min_emails observations, of which at least min_share went to one category, is
+    stable: lookup() returns that category so classification can be skipped. The
+    domain is only consulted for addresses without any history of their own, and
+    shared mailbox providers (SHARED_MAIL_DOMAINS) have no domain key at all.
+
+    The counts are outcomes of one set of classification rules. set_version() is
+    called with the current rules version, and drops every count when the rules
+    or the classifier engine changed.
+    """
+
+    def __init__(self, path, min_emails=SENDER_FAST_PATH_MIN_EMAILS, min_share=SENDER_FAST_PATH_MIN_SHARE):
+        self.path = path
+        self.min_emails = min_emails
+        self.min_share = min_share
+        self.counts = {}  # key -> {category: count}
+        self.pending = {}  # (key, category) -> count not yet written
+        self.fast_path_count = 0  # emails categorized by lookup() hits
+        self.version = None
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS sender_stats (
+                    key TEXT,
+                    category TEXT,
+                    count INTEGER,
+                    PRIMARY KEY (key, category)
+                )
+            """)
+            self.conn.execute("CREATE TABLE IF NOT EXISTS sender_stats_meta (name TEXT PRIMARY KEY, value TEXT)")
+            row = self.conn.execute("SELECT value FROM sender_stats_meta WHERE name = 'version'").fetchone()
+            self.version = row[0] if row else None
+            for key, category, count in self.conn.execute("SELECT key, category, count FROM sender_stats"):
+                self.counts.setdefault(key, {})[category] = count
+
+    @staticmethod
+    def keys(address):
+        """Return the index keys of a sender address: the address itself and, unless shared, its domain."""
+        address = (address or '').strip().lower()
+        if '@' not in address:
+            return [address] if address else []
+        domain = address.rsplit('@', 1)[1]
+        if domain in SHARED_MAIL_DOMAINS:
+            return [address]
+        return [address, '@' + domain]
+
+    def lookup(self, address):
+        """Return (category, share) if the sender or its domain has a stable history, else None."""
+        with self._lock:
+            for key in self.keys(address):
+                counts = self.counts.get(key)
+                if counts is None:
+                    continue
+                if not counts:
+                    # Known sender whose history was reset by a correction
+                    return None
+                total = sum(counts.values())
+                category, count = max(counts.items(), key=lambda item: item[1])
+                if total >= self.min_emails and count / total >= self.min_share and category not in UNSTABLE_CATEGORIES:
+                    self.fast_path_count += 1
+                    return category, count / total
+                # A sender with its own history is not judged by its domain
+                return None
+        return None
+
+    def set_version(self, version):
+        """Drop every count if they were recorded under another rules version than version."""
+        with self._lock, self.conn:
+            if version == self.version:
+                return
+            self.counts = {}
+            self.pending = {}
+            self.conn.execute("DELETE FROM sender_stats")
+            self.conn.execute("INSERT OR REPLACE INTO sender_stats_meta (name, value) VALUES ('version', ?)", (version,))
+            self.version = version
+
+    def observe(self, address, category):
+        """Record that an email from address was filed under category."""
+        with self._lock:
+            keys = self.keys(address)
+            if keys and keys[0] in self.counts:
+                keys = keys[:1]  # known sender, its domain already counted it
+            for key in keys:
+                counts = self.counts.setdefault(key, {})
+                counts[category] = counts.get(category, 0) + 1
+                self.pending[(key, category)] = self.pending.get((key, category), 0) + 1
+
+    def forget(self, address):
+        """Drop the history of one sender address, e.g. after the user corrected one of its emails."""
+        address = (address or '').strip().lower()
+        with self._lock, self.conn:
+            if address in self.counts:
+                self.counts[address] = {}  # still a known sender, so its domain is not counted twice
+            self.pending = {key: count for key, count in self.pending.items() if key[0] != address}
+            self.conn.execute("DELETE FROM sender_stats WHERE key = ?", (address,))
+
+    def flush(self):
+        """Write the counts recorded since the last flush."""
+        with self._lock, self.conn:
+            pending, self.pending = self.pending, {}
+            self.conn.executemany(
+                "INSERT INTO sender_stats (key, category, count) VALUES (?, ?, ?) "
+                "ON CONFLICT (key, category) DO UPDATE SET count = count + excluded.count",
+                [(key, category, count) for (key, category), count in pending.items()]
+            )
+
+    def close(self):
+        """Flush pending counts and close the database connection."""
+        self.flush()
+        with self._lock:
+            self.conn.close()
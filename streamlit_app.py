@@ -2,13 +2,13 @@ __import__('streamlit').config.set_option('server.fileWatcherType', 'none')
 import streamlit as st
 import os
 import torch
-from datetime import datetime
 import pandas as pd
 import time
 import openai
 import json
 from dotenv import load_dotenv
 from Automation import GmailAssistant, SCOPES
+from email_info import sanitize_for_html
 from constants import CATEGORY_DISPLAY_NAMES, AUTO_RESPONSE_CATEGORIES, AUTO_RESPONSE_WAITING_TIMES
 
 # Load environment variables for local development
@@ -126,7 +126,7 @@ def authenticate():
 
             # Initialize the assistant
             if 'assistant' not in st.session_state or st.session_state.assistant is None:
-                st.session_state.assistant = GmailAssistant()
+                st.session_state.assistant = GmailAssistant(metadata_first=True)
 
             # If service is None, we need to complete OAuth
             if st.session_state.assistant.service is None:
@@ -169,7 +169,7 @@ def authenticate():
                     st.experimental_set_query_params()
 
                     # Reinitialize the assistant with the new token
-                    st.session_state.assistant = GmailAssistant()
+                    st.session_state.assistant = GmailAssistant(metadata_first=True)
 
                     if st.session_state.assistant.service:
                         user_email = st.session_state.assistant.get_user_email()
@@ -269,8 +269,10 @@ def setup_model():
 def get_emails():
     """Get and sort emails."""
     with st.spinner("Loading emails..."):
-        st.session_state.sorted_emails = st.session_state.assistant.sort_emails()
+        st.session_state.sorted_emails = st.session_state.assistant.sort_emails(incremental=True)
         st.session_state.emails_loaded = True
+        if st.session_state.assistant.fetch_errors:
+            st.warning(f"{len(st.session_state.assistant.fetch_errors)} emails could not be loaded and were skipped.")
         # No need for user to click again, just update the UI automatically
 
 def view_and_respond(email):
@@ -278,11 +280,13 @@ def view_and_respond(email):
     st.session_state.selected_email = email
     st.rerun()  # Refresh UI to show the selected email details
 
-def mark_email_read(email_id):
+def mark_email_read(email):
     """Mark an email as read and refresh the email list."""
     with st.spinner("Marking as read..."):
-        success = st.session_state.assistant.mark_as_read(email_id)
+        success = st.session_state.assistant.mark_as_read(email['id'])
         if success:
+            # Reading an email from its category confirms the category to the learned model
+            st.session_state.assistant.learn_from_action(email)
             get_emails()  # Refresh the email list
             st.session_state.selected_email = None  # Clear selection
             st.success("Email marked as read")
@@ -291,66 +295,69 @@ def mark_email_read(email_id):
         else:
             st.error("Failed to mark email as read")
 
-def generate_email_response(email):
-    """Generate a response for the selected email."""
-    with st.spinner("Generating response..."):
-        try:
-            sender_name = st.session_state.assistant.extract_name(email['sender'])
-            
-            # Debug information
-            st.session_state.debug_info = {
-                'sender_name': sender_name,
-                'subject': email['subject'],
-                'body_length': len(email['body']) if email['body'] else 0
-            }
-            
-            # Check if model is loaded
-            if not st.session_state.hf_model_loaded:
-                # Use a simpler fallback response if model isn't loaded
-                response = f"Hello {sender_name},\n\nThank you for your email regarding \"{email['subject']}\".\nI've received your message and will get back to you soon with a more detailed response.\n\nBest regards,\n{st.session_state.assistant.get_user_name()}"
-            else:
-                # Use the AI model for response generation
-                response = st.session_state.assistant.generate_email(
-                    recipient_name=sender_name,
-                    original_subject=email['subject'],
-                    original_content=email['body']
-                )
-            
-            if not response or "Sorry, I can't assist with that" in response:
-                # If the model returned an invalid response, use a safe fallback
-                response = f"Hello {sender_name},\n\nThank you for your email regarding \"{email['subject']}\".\nI've received your message and will respond to it shortly.\n\nBest regards,\n{st.session_state.assistant.get_user_name()}"
-            
-            st.session_state.generated_response = response
-            st.rerun()  # Update UI to show the generated response
-        except Exception as e:
-            st.error(f"Error generating response: {str(e)}")
-            # Provide a fallback response
-            fallback_response = f"Hello,\n\nThank you for your email. I've received your message and will get back to you soon.\n\nBest regards,\n{st.session_state.assistant.get_user_name()}"
-            st.session_state.generated_response = fallback_response
-            st.rerun()
+def recategorize_email(email, category):
+    """Move an email to another category and teach the learned model the correction."""
+    st.session_state.assistant.recategorize(email, category)
+    st.session_state.sorted_emails = st.session_state.assistant.sort_emails(incremental=True)
+    st.session_state.selected_email = None
+    st.success(f"Moved to {CATEGORY_DISPLAY_NAMES.get(category, category)}")
+    time.sleep(0.5)  # Brief pause to show success message
+    st.rerun()  # Update UI
 
-def sanitize_for_html(text):
-    """
-    Sanitize text to be safely used in HTML.
-    Replaces special characters that might cause rendering issues.
-    """
-    if not text:
-        return ""
-    
-    # Replace characters that could cause HTML interpretation issues
-    replacements = {
-        "<": "&lt;",
-        ">": "&gt;",
-        "&": "&amp;",
-        '"': "&quot;",
-        "'": "&#39;",
-        "@": "&#64;",  # Replace @ with its HTML entity
-    }
+def generate_email_response(email, placeholder, use_cache=True):
+    """Generate a response for the selected email, streaming it into placeholder.
     
-    for char, replacement in replacements.items():
-        text = text.replace(char, replacement)
+    Tokens are shown as the model produces them; the cleaned-up email body then
+    becomes the editable response. By default a response generated earlier for
+    the same email is reused from the response cache; use_cache=False asks the
+    model for a new one.
+    """
+    try:
+        placeholder.text("Generating response...")
+        sender_name = st.session_state.assistant.extract_name(email['sender'])
+        st.session_state.assistant.ensure_body(email)
+        
+        # Debug information
+        st.session_state.debug_info = {
+            'sender_name': sender_name,
+            'subject': email['subject'],
+            'body_length': len(email['body']) if email['body'] else 0
+        }
+        
+        # Check if model is loaded
+        if not st.session_state.hf_model_loaded:
+            # Use a simpler fallback response if model isn't loaded
+            response = f"Hello {sender_name},\n\nThank you for your email regarding \"{email['subject']}\".\nI've received your message and will get back to you soon with a more detailed response.\n\nBest regards,\n{st.session_state.assistant.get_user_name()}"
+        else:
+            # Use the AI model for response generation, showing the text as it arrives
+            started = time.time()
+            generated_text = ''
+            for delta in st.session_state.assistant.generate_email(
+                recipient_name=sender_name,
+                original_subject=email['subject'],
+                original_content=email['body'],
+                use_cache=use_cache,
+                stream=True
+            ):
+                if not generated_text:
+                    st.session_state.debug_info['time_to_first_token'] = round(time.time() - started, 2)
+                generated_text += delta
+                placeholder.text(generated_text + " ▌")
+            st.session_state.debug_info['generation_time'] = round(time.time() - started, 2)
+            response = st.session_state.assistant._finish_email(generated_text)
+        
+        if not response or "Sorry, I can't assist with that" in response:
+            # If the model returned an invalid response, use a safe fallback
+            response = f"Hello {sender_name},\n\nThank you for your email regarding \"{email['subject']}\".\nI've received your message and will respond to it shortly.\n\nBest regards,\n{st.session_state.assistant.get_user_name()}"
+    except Exception as e:
+        st.error(f"Error generating response: {str(e)}")
+        # Provide a fallback response
+        response = f"Hello,\n\nThank you for your email. I've received your message and will get back to you soon.\n\nBest regards,\n{st.session_state.assistant.get_user_name()}"
     
-    return text
+    st.session_state.generated_response = response
+    # Drop the editor's previous text so it shows the new response
+    st.session_state.pop('response_editor', None)
+    st.rerun()  # Update UI to show the generated response
 
 def send_email_response(email, response_text):
     """Send a response email and update UI."""
@@ -385,6 +392,8 @@ def send_email_response(email, response_text):
             )
             
             if result:
+                # Replying from a category confirms the category to the learned model
+                st.session_state.assistant.learn_from_action(email)
                 # Mark as read after sending
                 st.session_state.assistant.mark_as_read(email['id'])
                 # Reset selected email
@@ -548,49 +557,43 @@ def run_auto_responses():
             waiting_time = auto_response_config.get('waiting_time', 5)
             
             # Sort emails and get the ones to process
-            sorted_emails = st.session_state.assistant.sort_emails()
+            sorted_emails = st.session_state.assistant.sort_emails(incremental=True)
             
             # Determine which categories to process
             categories_to_respond = AUTO_RESPONSE_CATEGORIES.get(categories_setting, ['priority_inbox'])
             process_all = categories_to_respond == 'all'
             
-            # Track processed emails
-            processed_emails = 0
+            assistant = st.session_state.assistant
             
-            # Process each category
+            # Collect the emails to answer
+            to_answer = []
             for category, emails in sorted_emails.items():
                 if process_all or category in categories_to_respond:
                     st.text(f"Processing {len(emails)} emails in {CATEGORY_DISPLAY_NAMES.get(category, category)}")
-                    
-                    for email in emails:
-                        # Extract important info
-                        sender_email = st.session_state.assistant.extract_email(email['sender'])
-                        sender_name = st.session_state.assistant.extract_name(email['sender'])
-                        
-                        # Generate response
-                        response_body = st.session_state.assistant.generate_email(
-                            recipient_name=sender_name,
-                            original_subject=email['subject'],
-                            original_content=email['body']
-                        )
-                        
-                        # Send response
-                        reply_subject = f"Re: {email['subject']}"
-                        result = st.session_state.assistant.send_email(
-                            to=sender_email,
-                            subject=reply_subject,
-                            body=response_body
-                        )
-                        
-                        if result:
-                            # Mark as read after processing
-                            st.session_state.assistant.mark_as_read(email['id'])
-                            processed_emails += 1
-                            # Brief progress update
-                            st.text(f"✓ Processed: {email['subject'][:40]}...")
+                    to_answer.extend(emails)
+            assistant.ensure_bodies(to_answer)
+            
+            # Generate all responses concurrently; stopping the app here sends none of them
+            replies = assistant.generate_emails(to_answer, use_cache=True)
+            
+            # Send the generated responses
+            processed_emails = 0
+            for email, response_body in zip(to_answer, replies):
+                if response_body is None:
+                    st.text(f"✗ No response generated: {email['subject'][:40]}...")
+                    continue
+                
+                # Queues mark-as-read; applied in bulk after the loop
+                if assistant.send_reply(email, response_body):
+                    processed_emails += 1
+                    # Brief progress update
+                    st.text(f"✓ Processed: {email['subject'][:40]}...")
             
-            # Update emails after processing
-            st.session_state.sorted_emails = st.session_state.assistant.sort_emails()
+            # Apply the queued mark-as-read changes, then update emails
+            failed_ids = st.session_state.assistant.flush_label_changes()
+            if failed_ids:
+                st.warning(f"{len(failed_ids)} emails could not be marked as read")
+            st.session_state.sorted_emails = st.session_state.assistant.sort_emails(incremental=True)
             st.session_state.emails_loaded = True
             
             if processed_emails > 0:
@@ -631,41 +634,24 @@ def display_emails():
     if categories:
         tabs = st.tabs(["All"] + [category_display_names.get(cat, cat.capitalize()) for cat in categories])
         
-        # Create a combined dataframe for "All" tab
+        # Collect every email for the "All" tab; the records carry their category, so nothing is copied
         all_emails = []
         for category, emails in st.session_state.sorted_emails.items():
             for email in emails:
-                email_copy = email.copy()
-                email_copy['category'] = category
-                all_emails.append(email_copy)
+                email['category'] = category
+                all_emails.append(email)
         
         # Display all emails in first tab
         with tabs[0]:
             if all_emails:
-                # Create a safe display version of the dataframe
-                safe_emails = []
-                for email in all_emails:
-                    safe_email = email.copy()
-                    # Sanitize sender field which may contain email addresses
-                    safe_email['sender'] = sanitize_for_html(email['sender'])
-                    safe_email['subject'] = sanitize_for_html(email['subject'])
-                    safe_emails.append(safe_email)
-                
-                df = pd.DataFrame(safe_emails)
-                # Format the dataframe
-                df = df[['category', 'subject', 'sender', 'date']]
-                df = df.rename(columns={
-                    'category': 'Category',
-                    'subject': 'Subject',
-                    'sender': 'Sender',
-                    'date': 'Date'
+                # Build the display columns from the lazily sanitized fields of each email
+                df = pd.DataFrame({
+                    'Category': [category_display_names.get(e['category'], e['category'].capitalize()) for e in all_emails],
+                    'Subject': [e.safe_subject for e in all_emails],
+                    'Sender': [e.safe_sender for e in all_emails],
+                    'Date': [e.display_date for e in all_emails]
                 })
                 
-                # Convert dates
-                df['Date'] = pd.to_datetime(df['Date']).dt.strftime('%Y-%m-%d %H:%M')
-                # Use the display names for categories in the dataframe
-                df['Category'] = df['Category'].map(lambda x: category_display_names.get(x, x.capitalize()))
-                
                 # Make the table selectable
                 selection = st.dataframe(
                     df,
@@ -681,7 +667,7 @@ def display_emails():
                 
                 # Create a selectbox for email selection with safe display options
                 if all_emails:
-                    email_options = [f"{sanitize_for_html(e['subject'])} - {sanitize_for_html(e['sender'])}" for e in all_emails]
+                    email_options = [f"{e.safe_subject} - {e.safe_sender}" for e in all_emails]
                     selected_index = st.selectbox("Select an email to view", 
                                                 range(len(email_options)), 
                                                 format_func=lambda i: email_options[i],
@@ -695,10 +681,10 @@ def display_emails():
                 emails = st.session_state.sorted_emails[category]
                 if emails:
                     for idx, email in enumerate(emails):
-                        # Sanitize email content for HTML display
-                        safe_subject = sanitize_for_html(email['subject'])
-                        safe_sender = sanitize_for_html(email['sender'])
-                        date_str = email['date'].strftime('%Y-%m-%d %H:%M') if isinstance(email['date'], datetime) else email['date']
+                        # Sanitized fields are computed once per email and reused across reruns
+                        safe_subject = email.safe_subject
+                        safe_sender = email.safe_sender
+                        date_str = email.display_date
                         
                         with st.container():
                             st.markdown(f"""
@@ -719,12 +705,17 @@ def display_email_details():
     if st.session_state.selected_email:
         email = st.session_state.selected_email
         
+        # Emails are listed from headers only; download the body now that it is opened
+        if email.get('body') is None:
+            with st.spinner("Loading email..."):
+                st.session_state.assistant.ensure_body(email)
+        
         st.markdown("<div class='category-header'>Email Details</div>", unsafe_allow_html=True)
         
         # Sanitize email content
-        safe_subject = sanitize_for_html(email['subject'])
-        safe_sender = sanitize_for_html(email['sender'])
-        date_str = email['date'].strftime('%Y-%m-%d %H:%M') if isinstance(email['date'], datetime) else email['date']
+        safe_subject = email.safe_subject
+        safe_sender = email.safe_sender
+        date_str = email.display_date
         
         # Email details columns
         col1, col2 = st.columns([3, 1])
@@ -755,12 +746,26 @@ def display_email_details():
         with col2:
             # Action buttons
             if st.button("Mark as Read", use_container_width=True):
-                mark_email_read(email['id'])
+                mark_email_read(email)
             
-            if st.button("Generate Response", use_container_width=True):
-                if not st.session_state.hf_model_loaded:
-                    st.warning("OpenAI integration not set up. Using a simple response template.")
-                generate_email_response(email)
+            # The response is generated below, where it streams into the response area
+            generate_requested = st.button("Generate Response", use_container_width=True)
+            if generate_requested and not st.session_state.hf_model_loaded:
+                st.warning("OpenAI integration not set up. Using a simple response template.")
+            
+            # Let the user correct the category; the learned model updates immediately
+            move_options = [
+                category for category in st.session_state.assistant._empty_categories()
+                if category not in ('needs_review', 'rules_in_training')
+            ]
+            new_category = st.selectbox(
+                "Move to category",
+                move_options,
+                format_func=lambda category: CATEGORY_DISPLAY_NAMES.get(category, category),
+                key=f"move_{email['id']}"
+            )
+            if st.button("Move", use_container_width=True):
+                recategorize_email(email, new_category)
         
         # Display email body (sanitize it too)
         safe_body = sanitize_for_html(email['body']) if email['body'] else ""
@@ -770,21 +775,29 @@ def display_email_details():
             st.text_area("Email Body", value=email['body'], height=200, disabled=True)
         
         # Display generated response if available
-        if st.session_state.generated_response:
+        if st.session_state.generated_response or generate_requested:
             st.markdown("### Emmy's Generated Response")
-            response_text = st.text_area(
+            response_area = st.empty()
+            if generate_requested:
+                generate_email_response(email, response_area)
+            
+            response_text = response_area.text_area(
                 "Edit Response Before Sending", 
                 value=st.session_state.generated_response, 
                 height=300,
                 key="response_editor"
             )
             
-            col1, col2 = st.columns([1, 1])
+            col1, col2, col3 = st.columns([1, 1, 1])
             with col1:
                 if st.button("Send Response", use_container_width=True):
                     send_email_response(email, response_text)
             
             with col2:
+                if st.button("Regenerate", use_container_width=True):
+                    generate_email_response(email, response_area, use_cache=False)
+            
+            with col3:
                 if st.button("Cancel", use_container_width=True):
                     cancel_response()
             
@@ -792,6 +805,8 @@ def display_email_details():
             with st.expander("Debug Information", expanded=False):
                 st.write("Generation Info:", st.session_state.debug_info)
                 st.write("Send Info:", st.session_state.debug_send)
+                if st.session_state.assistant.response_cache:
+                    st.write("Response Cache:", st.session_state.assistant.response_cache.stats())
 
 def main():
     """Main function to run the Streamlit app."""
@@ -0,0 +1,151 @@
+"""Trainable local text classifier for email categorization."""
+import os
+import re
+import tempfile
+import zlib
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9'_-]*")
+
+# Only the start of the body is used, which keeps feature extraction cost flat on huge emails
+MAX_BODY_CHARS = 2000
+
+
+def email_text(email_info):
+    """Return the text the model sees for an email: its subject followed by the start of its body.
+
+    Emails listed from metadata only (body not loaded yet) use their snippet instead,
+    so an email is described the same way whether or not its body was opened.
+    """
+    body = email_info.get('body')
+    if body is None:
+        body = email_info.get('snippet') or ''
+    return f"{email_info.get('subject', '')}\n{body[:MAX_BODY_CHARS]}"
+
+
+def hashed_features(text, n_features):
+    """Return the hashed indices of the word unigrams and bigrams in text (repeats kept)."""
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    grams = tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+    # crc32 is stable across processes, unlike hash(), so saved models stay valid
+    return np.fromiter(
+        (zlib.crc32(gram.encode('utf-8')) % n_features for gram in grams),
+        dtype=np.intp,
+        count=len(grams)
+    )
+
+
+class NaiveBayesClassifier:
+    """Multinomial naive Bayes over hashed word unigrams and bigrams.
+
+    Training only accumulates counts, so the model can be fit from scratch, updated
+    one email at a time with partial_fit, and saved to / loaded from an .npz file.
+    Prediction gathers the counts of the email's features for every class, which
+    keeps inference well under a millisecond per email on CPU.
+    """
+
+    def __init__(self, n_features=2 ** 17, alpha=1.0, classes=()):
+        self.n_features = n_features
+        self.alpha = alpha
+        self.classes = []
+        self.feature_counts = np.zeros((0, n_features), dtype=np.float32)
+        self.class_counts = np.zeros(0, dtype=np.float64)
+        self.total_counts = np.zeros(0, dtype=np.float64)
+        self.version = 0  # bumped on every update, lets callers invalidate cached predictions
+        self.fit_version = 0  # version after the last fit() from scratch, changes only on retraining
+        for label in classes:
+            self._class_index(label)
+
+    @property
+    def trained(self):
+        """True once the model has seen at least one labeled email."""
+        return bool(self.class_counts.sum())
+
+    def _class_index(self, label):
+        """Return the row of a class, adding a new class if needed."""
+        if label not in self.classes:
+            self.classes.append(label)
+            self.feature_counts = np.vstack([self.feature_counts, np.zeros((1, self.n_features), dtype=np.float32)])
+            self.class_counts = np.append(self.class_counts, 0.0)
+            self.total_counts = np.append(self.total_counts, 0.0)
+        return self.classes.index(label)
+
+    def fit(self, texts, labels):
+        """Train from scratch on texts and their labels."""
+        classes, version = self.classes, self.version
+        self.__init__(n_features=self.n_features, alpha=self.alpha, classes=classes)
+        self.version = version  # keep counting, so a refit model never reuses an old version
+        self.partial_fit(texts, labels)
+        self.fit_version = self.version
+        return self
+
+    def partial_fit(self, texts, labels):
+        """Update the model in place with more labeled texts; costs O(features of the texts)."""
+        for text, label in zip(texts, labels):
+            row = self._class_index(label)
+            features = hashed_features(text, self.n_features)
+            np.add.at(self.feature_counts[row], features, 1.0)
+            self.class_counts[row] += 1
+            self.total_counts[row] += len(features)
+        self.version += 1
+        return self
+
+    def predict_proba(self, text):
+        """Return the probability of every class for text, aligned with self.classes."""
+        if not self.trained:
+            return np.zeros(len(self.classes))
+
+        features = hashed_features(text, self.n_features)
+        log_prior = np.log((self.class_counts + 1.0) / (self.class_counts.sum() + len(self.classes)))
+        log_likelihood = (
+            np.log(self.feature_counts[:, features] + self.alpha).sum(axis=1)
+            - len(features) * np.log(self.total_counts + self.alpha * self.n_features)
+        )
+        joint = log_prior + log_likelihood
+        joint -= joint.max()
+        probabilities = np.exp(joint)
+        return probabilities / probabilities.sum()
+
+    def predict(self, text):
+        """Return the most likely (class, probability) for text, or (None, 0.0) if untrained."""
+        probabilities = self.predict_proba(text)
+        if not len(probabilities) or not self.trained:
+            return None, 0.0
+        best = int(probabilities.argmax())
+        return self.classes[best], float(probabilities[best])
+
+    def save(self, path):
+        """Save the model to an .npz file, replacing any previous file atomically."""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(suffix='.npz', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(
+                    f,
+                    classes=np.array(self.classes, dtype=str),
+                    feature_counts=self.feature_counts,
+                    class_counts=self.class_counts,
+                    total_counts=self.total_counts,
+                    params=np.array([self.n_features, self.alpha, self.version], dtype=np.float64),
+                    fit_version=np.array(self.fit_version, dtype=np.int64)
+                )
+            os.replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """Load a model saved with save()."""
+        with np.load(path) as data:
+            n_features, alpha, version = data['params']
+            model = cls(n_features=int(n_features), alpha=float(alpha))
+            model.classes = [str(label) for label in data['classes']]
+            model.feature_counts = data['feature_counts']
+            model.class_counts = data['class_counts']
+            model.total_counts = data['total_counts']
+            model.version = int(version)
+            # Models saved before fit_version was recorded count as one training run
+            model.fit_version = int(data['fit_version']) if 'fit_version' in data.files else 0
+        return model